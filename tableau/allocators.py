@@ -0,0 +1,131 @@
+# encoding: utf-8
+
+"""Allocators of the values of `auto` identifiers.
+
+Every DataSet asks its allocator for the identifier of each datum whose
+identifier is declared as `auto`.  DataSuite creates a
+SequentialAllocator starting at 1 for every schema unless told otherwise
+through its allocators argument.
+"""
+
+import threading
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+from tableau.declarations import DynamicField
+
+__all__ = [
+    'IDAllocator',
+    'SequentialAllocator',
+    'LocalCounter',
+    'SharedCounter',
+    'BlockAllocator',
+    'ContentHashAllocator',
+    ]
+
+class IDAllocator(object):
+    def allocate(self, datum):
+        """Returns the identifier for the datum."""
+        raise NotImplementedError()
+
+class SequentialAllocator(IDAllocator):
+    """Allocates consecutive identifiers starting at start, which is
+    typically 1 or the value next to MAX(id) of the existing rows."""
+
+    def __init__(self, start=1):
+        self.seq = start
+
+    def allocate(self, datum):
+        retval = self.seq
+        self.seq += 1
+        return retval
+
+class LocalCounter(object):
+    """Reserves blocks of identifiers for the allocators in the threads
+    of a single process."""
+
+    def __init__(self, start=1):
+        self.value = start
+        self.lock = threading.Lock()
+
+    def __call__(self, n):
+        self.lock.acquire()
+        try:
+            retval = self.value
+            self.value += n
+        finally:
+            self.lock.release()
+        return retval
+
+class SharedCounter(object):
+    """Reserves blocks of identifiers for the allocators in several
+    processes.  The counter has to be created before the processes and
+    handed to them, for example through the initializer of a
+    multiprocessing.Pool."""
+
+    def __init__(self, start=1):
+        import ctypes
+        import multiprocessing
+        self.value = multiprocessing.Value(ctypes.c_longlong, start)
+
+    def __call__(self, n):
+        self.value.get_lock().acquire()
+        try:
+            retval = self.value.value
+            self.value.value += n
+        finally:
+            self.value.get_lock().release()
+        return retval
+
+class BlockAllocator(IDAllocator):
+    """Allocates identifiers out of blocks of block_size consecutive
+    identifiers, each of which is reserved by calling reserve with the
+    size of the block.  Allocators sharing the same reserve function
+    (such as a LocalCounter or a SharedCounter) allocate disjoint ranges
+    of identifiers without coordinating for every datum."""
+
+    def __init__(self, reserve, block_size=1000):
+        self.reserve = reserve
+        self.block_size = block_size
+        self.next_id = 0
+        self.end = 0
+
+    def allocate(self, datum):
+        if self.next_id >= self.end:
+            self.next_id = self.reserve(self.block_size)
+            self.end = self.next_id + self.block_size
+        retval = self.next_id
+        self.next_id += 1
+        return retval
+
+class ContentHashAllocator(IDAllocator):
+    """Derives the identifiers from the schema and the values of the
+    fields of the data, so that the same datum gets the same identifier
+    across runs and processes.  Only the fields given in fields, or all
+    the plain (not dynamic) fields except for the identifiers if omitted,
+    are taken into account; they must be set before the datum is added.
+    The identifiers are positive integers of up to the given number of
+    bits, and ValueError is raised when one is derived twice."""
+
+    def __init__(self, fields=None, bits=63):
+        self.fields = fields
+        self.mask = (1 << bits) - 1
+        self.allocated = set()
+
+    def digest_of(self, datum):
+        if self.fields is None:
+            id_fields = datum._tableau_id_fields
+            values = sorted(
+                (k, v) for k, v in datum._tableau_fields.iteritems()
+                if k not in id_fields and not isinstance(v, DynamicField))
+        else:
+            values = [(k, getattr(datum, k)) for k in self.fields]
+        return sha1(repr((datum._tableau_schema, values))).hexdigest()
+
+    def allocate(self, datum):
+        retval = (int(self.digest_of(datum), 16) & self.mask) or 1
+        if retval in self.allocated:
+            raise ValueError("identifier %d derived for %r has already been allocated" % (retval, datum))
+        self.allocated.add(retval)
+        return retval
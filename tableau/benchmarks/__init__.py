@@ -0,0 +1,290 @@
+# encoding: utf-8
+
+"""Benchmarks of building, walking and rendering synthetic object graphs.
+
+Run them with ``python -m tableau.benchmarks`` (or by calling main() on
+Python versions whose -m switch doesn't take packages)::
+
+    python -m tableau.benchmarks -o baseline.json
+    # ... upgrade something ...
+    python -m tableau.benchmarks -o current.json -c baseline.json
+
+The results are written as JSON, keyed by the name and size of each
+case.  With -c, every case that got slower than the baseline by more
+than the threshold is reported as a regression, and the exit status
+becomes 1.  Cases that need an optional module, such as SQLAlchemy,
+are skipped when it is not installed.
+"""
+
+import gc
+import sys
+import time
+import platform
+from fnmatch import fnmatch
+from optparse import OptionParser
+from StringIO import StringIO
+from timeit import default_timer
+try:
+    import json
+except ImportError:
+    import simplejson as json
+from tableau.dataset import DataSuite, DataWalker
+from tableau.sql import SQLGenerator
+from tableau.benchmarks import graphs
+
+__all__ = [
+    'Case',
+    'cases',
+    'case',
+    'run',
+    'compare',
+    'load',
+    'save',
+    'main',
+    ]
+
+FORMAT_VERSION = 1
+
+DEFAULT_SIZES = (1000, 10000)
+
+class Case(object):
+    """A benchmark.  setup is called with the size before every
+    repetition and returns a pair of the function to time and a function
+    to clean up afterwards (or None); the timed function returns the
+    number of data it has processed."""
+
+    def __init__(self, name, setup, sizes=DEFAULT_SIZES, requires=()):
+        self.name = name
+        self.setup = setup
+        self.sizes = sizes
+        self.requires = requires
+
+    def is_available(self):
+        for module in self.requires:
+            try:
+                __import__(module)
+            except ImportError:
+                return False
+        return True
+
+    def measure(self, size, repeat):
+        timings = []
+        items = 0
+        for i in range(0, repeat):
+            func, cleanup = self.setup(size)
+            try:
+                gc.collect()
+                gc_enabled = gc.isenabled()
+                gc.disable()
+                try:
+                    start = default_timer()
+                    items = func()
+                    timings.append(default_timer() - start)
+                finally:
+                    if gc_enabled:
+                        gc.enable()
+            finally:
+                if cleanup is not None:
+                    cleanup()
+        best = min(timings)
+        return {
+            'name': self.name,
+            'size': size,
+            'items': items,
+            'best': best,
+            'mean': sum(timings) / len(timings),
+            'rate': best and items / best or None,
+            }
+
+cases = []
+
+def case(name, sizes=DEFAULT_SIZES, requires=()):
+    """Registers the decorated setup function as a case."""
+    def decorate(setup):
+        cases.append(Case(name, setup, sizes, requires))
+        return setup
+    return decorate
+
+def _count(suite):
+    return sum(len(dataset.data) for dataset in suite)
+
+def _walk(roots):
+    suite = DataSuite()
+    walker = DataWalker(suite)
+    for root in roots:
+        walker(root)
+    return suite
+
+GRAPHS = [
+    ('wide', graphs.wide),
+    ('chain', graphs.chain),
+    ('fanout', graphs.fanout),
+    ('via', graphs.via),
+    ]
+
+def _define_graph_cases(graph_name, build):
+    @case('construct.%s' % graph_name)
+    def construct(size):
+        n = _count(_walk(build(size)))
+        return (lambda: build(size) and n), None
+
+    @case('walk.%s' % graph_name)
+    def walk(size):
+        roots = build(size)
+        return (lambda: _count(_walk(roots))), None
+
+    @case('sql.%s' % graph_name)
+    def sql(size):
+        suite = _walk(build(size))
+        def func():
+            SQLGenerator(StringIO(), encoding='utf-8')(suite)
+            return _count(suite)
+        return func, None
+
+for graph_name, build in GRAPHS:
+    _define_graph_cases(graph_name, build)
+
+@case('dataset.get')
+def dataset_get(size):
+    suite = _walk(graphs.fanout(size))
+    def func():
+        n = 0
+        for dataset in suite:
+            n += len(dataset.get())
+        return n
+    return func, None
+
+def _setup_sqla():
+    from sqlalchemy.schema import MetaData
+    from tableau.sqla import newSADatum
+    metadata = MetaData()
+    graphs.define_models(metadata)
+    SADatum = newSADatum(metadata)
+    return SADatum, SADatum.cleanup
+
+@case('construct.sqla', requires=('sqlalchemy', ))
+def construct_sqla(size):
+    SADatum, cleanup = _setup_sqla()
+    n = _count(_walk(graphs.sqla(SADatum, size)))
+    return (lambda: graphs.sqla(SADatum, size) and n), cleanup
+
+@case('walk.sqla', requires=('sqlalchemy', ))
+def walk_sqla(size):
+    SADatum, cleanup = _setup_sqla()
+    roots = graphs.sqla(SADatum, size)
+    return (lambda: _count(_walk(roots))), cleanup
+
+@case('sql.sqla', requires=('sqlalchemy', ))
+def sql_sqla(size):
+    SADatum, cleanup = _setup_sqla()
+    suite = _walk(graphs.sqla(SADatum, size))
+    def func():
+        SQLGenerator(StringIO(), encoding='utf-8')(suite)
+        return _count(suite)
+    return func, cleanup
+
+def key_of(result):
+    return '%s/%d' % (result['name'], result['size'])
+
+def run(patterns=None, sizes=None, repeat=3, out=None):
+    """Runs the cases whose names match any of the shell-style patterns
+    (all of them if omitted) at the given sizes (or their own default
+    sizes), and returns the results."""
+    results = {}
+    skipped = []
+    for case_ in cases:
+        if patterns and not [pattern for pattern in patterns if fnmatch(case_.name, pattern)]:
+            continue
+        if not case_.is_available():
+            skipped.append(case_.name)
+            if out is not None:
+                out.write('%-24s skipped (requires %s)\n' % (case_.name, ', '.join(case_.requires)))
+            continue
+        for size in sizes or case_.sizes:
+            result = case_.measure(size, repeat)
+            results[key_of(result)] = result
+            if out is not None:
+                out.write('%-24s %8d %10.4fs %12.0f items/s\n' % (case_.name, size, result['best'], result['rate'] or 0))
+                out.flush()
+    return {
+        'version': FORMAT_VERSION,
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'implementation': getattr(platform, 'python_implementation', lambda: 'CPython')(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'skipped': skipped,
+        'results': results,
+        }
+
+def compare(baseline, current, threshold=0.1):
+    """Compares the best timings of the cases found in both results, and
+    returns a list of (key, baseline, current, ratio) tuples, ordered by
+    key, with ratio being current / baseline, along with the list of
+    the keys of the regressions, whose ratio exceeds 1 + threshold."""
+    rows = []
+    regressions = []
+    baseline_results = baseline['results']
+    for key, result in sorted(current['results'].iteritems()):
+        baseline_result = baseline_results.get(key)
+        if baseline_result is None or not baseline_result['best']:
+            continue
+        ratio = result['best'] / baseline_result['best']
+        rows.append((key, baseline_result['best'], result['best'], ratio))
+        if ratio > 1 + threshold:
+            regressions.append(key)
+    return rows, regressions
+
+def load(path):
+    f = open(path)
+    try:
+        retval = json.load(f)
+    finally:
+        f.close()
+    if retval.get('version') != FORMAT_VERSION:
+        raise ValueError("%s is not a benchmark result of version %d" % (path, FORMAT_VERSION))
+    return retval
+
+def save(results, path):
+    f = open(path, 'w')
+    try:
+        json.dump(results, f, indent=2, sort_keys=True)
+    finally:
+        f.close()
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] [pattern...]')
+    parser.add_option('-o', '--output', metavar='FILE', help="write the results to FILE as JSON")
+    parser.add_option('-c', '--compare', metavar='FILE', help="compare the results against the baseline saved in FILE")
+    parser.add_option('-t', '--threshold', type='float', default=0.1, help="tolerated slowdown relative to the baseline [default: %default]")
+    parser.add_option('-s', '--sizes', help="comma-separated sizes overriding those of every case")
+    parser.add_option('-r', '--repeat', type='int', default=3, help="number of repetitions of each case [default: %default]")
+    parser.add_option('-l', '--list', action='store_true', default=False, help="list the cases and exit")
+    options, patterns = parser.parse_args(argv)
+    out = sys.stdout
+
+    if options.list:
+        for case_ in cases:
+            out.write('%-24s %s\n' % (case_.name, ', '.join(str(size) for size in case_.sizes)))
+        return 0
+
+    sizes = None
+    if options.sizes:
+        sizes = [int(size) for size in options.sizes.split(',')]
+    baseline = None
+    if options.compare:
+        baseline = load(options.compare)
+
+    results = run(patterns, sizes, options.repeat, out)
+    if options.output:
+        save(results, options.output)
+
+    if baseline is not None:
+        rows, regressions = compare(baseline, results, options.threshold)
+        out.write('\n')
+        for key, baseline_best, best, ratio in rows:
+            out.write('%-32s %10.4fs %10.4fs %7.2fx%s\n' % (key, baseline_best, best, ratio, key in regressions and '  REGRESSION' or ''))
+        if regressions:
+            out.write('\n%d regression(s) exceeding %.0f%%\n' % (len(regressions), options.threshold * 100))
+            return 1
+    return 0
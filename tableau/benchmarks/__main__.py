@@ -0,0 +1,4 @@
+import sys
+from tableau.benchmarks import main
+
+sys.exit(main())
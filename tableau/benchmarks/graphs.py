@@ -0,0 +1,92 @@
+# encoding: utf-8
+
+"""Synthetic object graphs of a given size.  Every function returns a
+list of roots holding roughly size data in total, and builds the same
+graph every time it is called with the same arguments."""
+
+from tableau.containers import Datum
+from tableau.declarations import one_to_many, many_to_many, auto
+
+def wide(size, width=30):
+    """size data of a single schema, each with width plain fields."""
+    return [
+        Datum('Wide', auto('id'), **dict(('field%02d' % j, i * width + j) for j in range(0, width)))
+        for i in xrange(size)
+        ]
+
+def chain(size):
+    """A single chain of size data, each owning the next one."""
+    datum = Datum('Link', auto('id'), parent_id=None, depth=size - 1)
+    for depth in xrange(size - 2, -1, -1):
+        datum = Datum('Link', auto('id'), depth=depth, children=one_to_many([datum], 'parent_id'))
+    return [datum]
+
+def fanout(size, fanout=100):
+    """Roots owning fanout children each, size data in total."""
+    return [
+        Datum(
+            'Parent',
+            auto('id'),
+            name=u'parent%d' % i,
+            children=one_to_many([
+                Datum('Child', auto('id'), name=u'child%d-%d' % (i, j), position=j)
+                for j in range(0, fanout)
+                ], 'parent_id')
+            )
+        for i in xrange(max(size // (fanout + 1), 1))
+        ]
+
+def via(size, num_groups=10, groups_per_member=3):
+    """Members each associated with some of the num_groups groups through
+    an intermediate schema, about size data in total."""
+    groups = [Datum('Group', auto('id'), name=u'group%d' % i) for i in range(0, num_groups)]
+    return [
+        Datum(
+            'Member',
+            auto('id'),
+            name=u'member%d' % i,
+            groups=many_to_many(
+                [groups[(i + j) % num_groups] for j in range(0, groups_per_member)],
+                'member_id', 'group_id', via='Membership'
+                )
+            )
+        for i in xrange(max(size // (groups_per_member + 1), 1))
+        ]
+
+def define_models(metadata):
+    """Defines the mapped classes used by sqla(); requires SQLAlchemy."""
+    from sqlalchemy.schema import Column, ForeignKey
+    from sqlalchemy.types import Integer, String
+    from sqlalchemy.ext.declarative import declarative_base
+    from sqlalchemy.orm import relationship
+    Base = declarative_base(metadata=metadata)
+
+    class Author(Base):
+        __tablename__ = 'Author'
+        id = Column(Integer, primary_key=True)
+        name = Column(String(64))
+        books = relationship('Book')
+
+    class Book(Base):
+        __tablename__ = 'Book'
+        id = Column(Integer, primary_key=True)
+        author_id = Column(Integer, ForeignKey('Author.id'))
+        title = Column(String(64))
+        pages = Column(Integer, default=100)
+
+    return Base
+
+def sqla(SADatum, size, fanout=10):
+    """Authors owning fanout books each, built with a factory made by
+    newSADatum() for the metadata of define_models()."""
+    return [
+        SADatum(
+            'Author',
+            name=u'author%d' % i,
+            books=one_to_many([
+                SADatum('Book', title=u'book%d-%d' % (i, j))
+                for j in range(0, fanout)
+                ], 'author_id')
+            )
+        for i in xrange(max(size // (fanout + 1), 1))
+        ]
@@ -1,22 +1,112 @@
 # encoding: utf-8
 
-from containers import Datum
+from copy import copy
+from types import FunctionType
+from containers import Datum, DatumBase, id_fields_from_value
+from declarations import DynamicField
+from utils import is_iterable_container, is_callable
+
+class each(object):
+    """Gives every datum built by build_many() a value of its own; either
+    the item at the datum's index in the sequence, or the return value of
+    the callable applied to the index."""
+
+    def __init__(self, source):
+        if is_callable(source):
+            self.func = source
+        else:
+            self.func = list(source).__getitem__
+
+    def __call__(self, i):
+        return self.func(i)
+
+def _is_static(value):
+    # whether the datum would keep the value as it is
+    return not isinstance(value, (FunctionType, DatumBase, DynamicField)) and \
+           (isinstance(value, basestring) or not is_iterable_container(value))
+
+def _split_fields(fields):
+    static = {}
+    dynamic = []
+    for k, v in fields.iteritems():
+        if _is_static(v):
+            static[k] = v
+        else:
+            dynamic.append((k, v))
+    return static, dynamic
 
 class BuilderMeta(type):
     def __new__(cls, name, bases, dict):
         dict.setdefault('__schema__', name)
-        dict.setdefault('__id_fields__', ('id', ))
+        if '__id_fields__' not in dict:
+            for base in bases:
+                if hasattr(base, '__id_fields__'):
+                    dict['__id_fields__'] = base.__id_fields__
+                    break
+            else:
+                dict['__id_fields__'] = ('id', )
+        fields = {}
+        for base in reversed(bases):
+            fields.update(getattr(base, '__fields__', ()))
+        fields.update(pair for pair in dict.items() if not pair[0].startswith('__'))
+        dict['__fields__'] = fields
+        dict['__template__'] = _split_fields(fields)
         return type.__new__(cls, name, bases, dict)
 
+    def _new_datum(self, id_fields, static, dynamic):
+        datum = object.__new__(Datum)
+        datum.__dict__ = {
+            '_tableau_schema': self.__dict__['__schema__'],
+            '_tableau_id_fields': id_fields,
+            '_tableau_fields': static,
+            }
+        for k, v in dynamic:
+            if isinstance(v, DynamicField):
+                # bind() ties the field to a single container
+                v = copy(v)
+            setattr(datum, k, v)
+        return datum
+
     def __call__(self, *args, **kwargs):
-        field_values = dict(pair for pair in self.__dict__.items() if not pair[0].startswith('__'))
-        field_values.update(kwargs)
         if self == Builder:
             raise TypeError("Only subclasses of Builder object is instantiable")
-        return Datum(
-            self.__dict__['__schema__'],
-            self.__dict__['__id_fields__'],
-            **field_values)
+        static, dynamic = self.__dict__['__template__']
+        static = static.copy()
+        if kwargs:
+            _static, _dynamic = _split_fields(kwargs)
+            static.update(_static)
+            dynamic = [pair for pair in dynamic if pair[0] not in kwargs] + _dynamic
+            for k, v in _dynamic:
+                static.pop(k, None)
+        return self._new_datum(id_fields_from_value(self.__dict__['__id_fields__']), static, dynamic)
+
+    def build_many(self, n, **overrides):
+        """Builds n data at once.  The overrides apply to every datum,
+        except for those given as each(...), which are evaluated for every
+        index from 0 to n - 1."""
+        if self == Builder:
+            raise TypeError("Only subclasses of Builder object is instantiable")
+        per_index = [(k, v) for k, v in overrides.iteritems() if isinstance(v, each)]
+        _static, _dynamic = _split_fields(dict((k, v) for k, v in overrides.iteritems() if not isinstance(v, each)))
+        static, dynamic = self.__dict__['__template__']
+        static = dict((k, v) for k, v in static.iteritems() if k not in overrides)
+        static.update(_static)
+        dynamic = [pair for pair in dynamic if pair[0] not in overrides] + _dynamic
+        id_fields = id_fields_from_value(self.__dict__['__id_fields__'])
+        retval = []
+        for i in xrange(n):
+            fields = static.copy()
+            _dynamic = dynamic
+            for k, e in per_index:
+                v = e(i)
+                if _is_static(v):
+                    fields[k] = v
+                else:
+                    if _dynamic is dynamic:
+                        _dynamic = list(dynamic)
+                    _dynamic.append((k, v))
+            retval.append(self._new_datum(id_fields, fields, _dynamic))
+        return retval
 
 class Builder(object):
     __metaclass__ = BuilderMeta
@@ -1,6 +1,7 @@
 # encoding: utf-8
 
 from types import FunctionType
+from UserDict import DictMixin
 from tableau.declarations import DynamicField, Aggregation, Lazy, one_to_many, many_to_one
 from tableau.utils import _repr, is_iterable_container
 
@@ -10,10 +11,34 @@ def value_of(value):
     else:
         return value
 
+def id_fields_from_value(id_fields):
+    if isinstance(id_fields, basestring):
+        return (id_fields, )
+    elif isinstance(id_fields, tuple):
+        return id_fields
+    else:
+        return tuple(id_fields)
+
+def field_from_value(datum, k, v):
+    if isinstance(v, FunctionType):
+        v = Lazy(v)
+    elif isinstance(v, DatumBase):
+        # implicit many_to_one
+        v = many_to_one(v, k, v._tableau_id_fields)
+    elif is_iterable_container(v):
+        # implicit one_to_many
+        v = one_to_many(v, k)
+    if isinstance(v, DynamicField):
+        v.bind(datum, k)
+    return v
+
 class DatumBase(object):
+    __slots__ = ()
+
     _tableau_schema = None
     _tableau_id_fields = None
     _tableau_fields = None
+    _tableau_fixed = False
 
     @property
     def _id(self):
@@ -25,12 +50,7 @@ class DatumBase(object):
 class Datum(DatumBase):
     def __init__(self, schema, id_fields, **fields):
         self._tableau_schema = schema
-        if isinstance(id_fields, basestring):
-            self._tableau_id_fields = (id_fields, )
-        elif isinstance(id_fields, tuple):
-            self._tableau_id_fields = id_fields
-        else:
-            self._tableau_id_fields = tuple(id_fields)
+        self._tableau_id_fields = id_fields_from_value(id_fields)
         self._tableau_fields = {}
         for k, v in fields.iteritems():
             setattr(self, k, v)
@@ -39,17 +59,7 @@ class Datum(DatumBase):
         if k.startswith('_'):
             object.__setattr__(self, k, v)
         else:
-            if isinstance(v, FunctionType):
-                v = Lazy(v)
-            elif isinstance(v, DatumBase):
-                # implicit many_to_one
-                v = many_to_one(v, k, v._tableau_id_fields)
-            elif is_iterable_container(v):
-                # implicit one_to_many
-                v = one_to_many(v, k)
-            if isinstance(v, DynamicField):
-                v.bind(self, k)
-            self._tableau_fields[k] = v
+            self._tableau_fields[k] = field_from_value(self, k, v)
 
     def __getattribute__(self, k):
         if k.startswith('_'):
@@ -68,3 +78,143 @@ class Datum(DatumBase):
 
     def __repr__(self):
         return 'Datum(%r, %r, %s)' % (self._tableau_schema, self._tableau_id_fields, ', '.join('%s=%s' % (pair[0], '...' if isinstance(pair[1], Aggregation) else _repr(value_of(pair[1]))) for pair in self._tableau_fields.iteritems()))
+
+class SlottedFieldsView(object, DictMixin):
+    """A mapping view over the fields stored in the slots of a
+    SlottedDatum, standing in for Datum's per-instance dictionary."""
+
+    def __init__(self, datum):
+        self.datum = datum
+
+    def __getitem__(self, k):
+        slot = self.datum._tableau_slots.get(k)
+        if slot is None:
+            raise KeyError(k)
+        try:
+            return slot.__get__(self.datum)
+        except AttributeError:
+            raise KeyError(k)
+
+    def __setitem__(self, k, v):
+        slot = self.datum._tableau_slots.get(k)
+        if slot is None:
+            raise KeyError(k)
+        slot.__set__(self.datum, v)
+
+    def __delitem__(self, k):
+        slot = self.datum._tableau_slots.get(k)
+        if slot is None:
+            raise KeyError(k)
+        try:
+            slot.__delete__(self.datum)
+        except AttributeError:
+            raise KeyError(k)
+
+    def iteritems(self):
+        datum = self.datum
+        slots = datum._tableau_slots
+        for k in datum._tableau_field_names:
+            try:
+                yield k, slots[k].__get__(datum)
+            except AttributeError:
+                pass
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __iter__(self):
+        for k, v in self.iteritems():
+            yield k
+
+    def keys(self):
+        return list(self)
+
+    def __contains__(self, k):
+        try:
+            self[k]
+            return True
+        except KeyError:
+            return False
+
+    def __len__(self):
+        return len(self.keys())
+
+class SlottedField(object):
+    __slots__ = ('name', 'slot')
+
+    def __init__(self, name, slot):
+        self.name = name
+        self.slot = slot
+
+    def __get__(self, datum, owner=None):
+        if datum is None:
+            return self
+        try:
+            v = self.slot.__get__(datum)
+        except AttributeError:
+            raise AttributeError('%s.%s' % (datum._tableau_schema, self.name))
+        if isinstance(v, DynamicField):
+            return v()
+        return v
+
+    def __set__(self, datum, v):
+        self.slot.__set__(datum, field_from_value(datum, self.name, v))
+
+    def __delete__(self, datum):
+        self.slot.__delete__(datum)
+
+class SlottedDatum(DatumBase):
+    """The base class of the datum classes generated by newDatumClass().
+    The schema and the identifiers are shared by the class, and every
+    field is kept in a slot of its own."""
+
+    __slots__ = ('__weakref__', '_tableau_fixed')
+
+    _tableau_slots = None
+    _tableau_field_names = None
+
+    def __init__(self, **fields):
+        self._tableau_fixed = False
+        for k, v in fields.iteritems():
+            if k not in self._tableau_slots:
+                raise TypeError("%s is not declared in %s" % (k, self.__class__.__name__))
+            setattr(self, k, v)
+
+    @property
+    def _tableau_fields(self):
+        return SlottedFieldsView(self)
+
+    def __repr__(self):
+        return 'Datum(%r, %r, %s)' % (self._tableau_schema, self._tableau_id_fields, ', '.join('%s=%s' % (pair[0], '...' if isinstance(pair[1], Aggregation) else _repr(value_of(pair[1]))) for pair in self._tableau_fields.iteritems()))
+
+def newDatumClass(schema, id_fields=None, fields=()):
+    """Generates a SlottedDatum subclass for the schema.  Either pass the
+    schema name, the identifiers and the names of the other fields, or
+    pass a datum alone to infer them from it."""
+    if isinstance(schema, DatumBase):
+        prototype = schema
+        schema = prototype._tableau_schema
+        if id_fields is None:
+            id_fields = prototype._tableau_id_fields
+        fields = tuple(fields) + tuple(k for k, v in prototype._tableau_fields.iteritems())
+    if id_fields is None:
+        raise TypeError("id_fields must be specified")
+    id_fields = id_fields_from_value(id_fields)
+    field_names = list(id_fields)
+    for k in fields:
+        if k not in field_names:
+            field_names.append(k)
+    slot_names = tuple('_tableau_f_%s' % k for k in field_names)
+    class_ = type('Datum#%s' % schema, (SlottedDatum, ), {
+        '__slots__': slot_names,
+        '_tableau_schema': schema,
+        '_tableau_id_fields': id_fields,
+        '_tableau_field_names': tuple(field_names),
+        })
+    slots = {}
+    for k, slot_name in zip(field_names, slot_names):
+        slot = class_.__dict__[slot_name]
+        slots[k] = slot
+        setattr(class_, k, SlottedField(k, slot))
+    class_._tableau_slots = slots
+    return class_
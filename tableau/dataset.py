@@ -5,160 +5,553 @@ import logging
 import re
 from warnings import warn
 from itertools import chain
+from weakref import WeakKeyDictionary
+from timeit import default_timer
 from tableau.containers import Datum
 from tableau.declarations import one_to_many, many_to_many, many_to_one, DynamicField, auto
+from tableau.allocators import SequentialAllocator
 
 __all__ = [
     'DataSet',
     'ReferenceGraph',
+    'CyclicReferenceError',
     'DataSuite',
+    'DataSuiteCheckpoint',
     'DataWalker',
     ]
 
+def _sort_key(datum):
+    return tuple(getattr(datum, k) for k in datum._tableau_id_fields)
+
+class FieldIndex(object):
+    """A hash index of the data in a data set by the values of the
+    fields.  It is brought up to date with the data added since the last
+    lookup, indexing a datum once the walker has fixed it or once no walk
+    is in progress; the data a walk is still on are matched one by
+    one."""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.entries = {}
+        self.mark = 0
+        self.unfixed = []
+
+    def key_of(self, datum):
+        try:
+            return tuple(getattr(datum, k) for k in self.fields)
+        except AttributeError:
+            return None
+
+    def _put(self, datum):
+        key = self.key_of(datum)
+        if key is not None:
+            data = self.entries.get(key)
+            if data is None:
+                self.entries[key] = [datum]
+            else:
+                data.append(datum)
+
+    def update(self, dataset):
+        mark = dataset.mark()
+        if self.mark == mark and not self.unfixed:
+            return
+        # the data added outside a walker are never fixed
+        walking = dataset.suite is not None and dataset.suite.walking
+        unfixed = []
+        for datum in chain(self.unfixed, dataset.log[max(self.mark - dataset.log_base, 0):]):
+            if datum._tableau_fixed or not walking:
+                self._put(datum)
+            else:
+                unfixed.append(datum)
+        self.unfixed = unfixed
+        self.mark = mark
+
+    def lookup(self, key):
+        retval = list(self.entries.get(key, ()))
+        for datum in self.unfixed:
+            if self.key_of(datum) == key:
+                retval.append(datum)
+        return retval
+
 class DataSet(object):
+    """The data of a schema.  If natural_key, a sequence of field names,
+    is given, a datum whose values of those fields are equal to those of
+    a datum already added is not added; canonical_of() gives the one
+    that was added instead."""
+
     logger = logging.getLogger('tableau.DataSet')
 
-    def __init__(self, schema):
+    def __init__(self, schema, allocator=None, observer=None, natural_key=None):
         self.schema = schema
         self.data = set()
-        self.seq = 1
+        if allocator is None:
+            allocator = SequentialAllocator()
+        self.allocator = allocator
+        self.sorted_data = None
+        self.drained = None
+        self.log = []
+        self.log_base = 0
+        self.observer = observer
+        self.indexes = {}
+        self.suite = None
+        if natural_key is not None:
+            natural_key = tuple(natural_key)
+            self.canonical_data = {}
+        self.natural_key = natural_key
+
+    def natural_key_of(self, datum):
+        return tuple(getattr(datum, k) for k in self.natural_key)
+
+    def canonical_of(self, datum):
+        """Returns the datum added in place of the datum, which is the
+        datum itself unless a natural key is in effect."""
+        if self.natural_key is None:
+            return datum
+        return self.canonical_data.get(self.natural_key_of(datum), datum)
+
+    def __contains__(self, datum):
+        return datum in self.data or (self.drained is not None and datum in self.drained)
 
     def add(self, datum):
         if datum in self.data:
             return False
+        if self.drained is not None and datum in self.drained:
+            return False
+        if self.natural_key is not None:
+            key = self.natural_key_of(datum)
+            if key in self.canonical_data:
+                return False
+            # the canonical data are kept even after being drained so that
+            # their duplicates are never added again
+            self.canonical_data[key] = datum
 
         if self.logger.isEnabledFor(logging.DEBUG):
             self.logger.debug('Trying to add %s' % datum)
 
-        if isinstance(datum._tableau_id_fields, auto):
-            setattr(datum, datum._tableau_id_fields[0], self.seq)
-            assert getattr(datum, datum._tableau_id_fields[0], self.seq)
-            self.seq += 1
+        id_fields = datum._tableau_id_fields
+        if isinstance(id_fields, auto):
+            setattr(datum, id_fields[0], self.allocator.allocate(datum))
         self.data.add(datum)
+        self.log.append(datum)
+        self.sorted_data = None
+        if self.observer is not None:
+            self.observer.datum_added(self.schema, datum)
         return True
 
+    def _get_seq(self):
+        return getattr(self.allocator, 'seq', None)
+
+    def _set_seq(self, seq):
+        self.allocator.seq = seq
+
+    seq = property(_get_seq, _set_seq, doc="""The next identifier of a
+        sequential allocator, or None for the other kinds of allocators.""")
+
+    def restore(self, data, seq):
+        """Puts the data, which are already fixed and ordered by their
+        identifiers, into the set as they are, and resumes the sequence
+        of auto identifiers from seq unless it is None."""
+        if self.natural_key is not None:
+            for datum in data:
+                self.canonical_data.setdefault(self.natural_key_of(datum), datum)
+        self.data.update(data)
+        self.log.extend(data)
+        if self.sorted_data is None and len(self.data) == len(data):
+            self.sorted_data = list(data)
+        else:
+            self.sorted_data = None
+        if seq is not None:
+            self.seq = seq
+
+    def _get_sorted_data(self):
+        if self.sorted_data is None:
+            self.sorted_data = sorted(self.data, key=_sort_key)
+        return self.sorted_data
+
     def get(self):
-        return sorted(iter(self.data),
-            lambda a, b: \
-                cmp(getattr(a, a._tableau_id_fields[0]), getattr(b, b._tableau_id_fields[0])) \
-                if a._tableau_id_fields and b._tableau_id_fields else 0)
+        """Returns the data ordered by their identifiers.  The order is
+        computed once and reused until another datum gets added."""
+        return list(self._get_sorted_data())
 
     def __iter__(self):
-        return iter(self.get())
- 
+        return iter(self._get_sorted_data())
+
+    def __len__(self):
+        return len(self.data)
+
+    def drain(self):
+        """Removes every datum from the set and returns them in order.
+        The drained data are still remembered by weak references so they
+        won't be added again as long as they are alive."""
+        data = self._get_sorted_data()
+        if self.drained is None:
+            self.drained = WeakKeyDictionary()
+        for datum in data:
+            self.drained[datum] = True
+        self.data = set()
+        self.sorted_data = None
+        self.log_base += len(self.log)
+        self.log = []
+        self.indexes = {}
+        if self.observer is not None:
+            self.observer.data_drained(self.schema, len(data))
+        return data
+
+    def find(self, **criteria):
+        """Returns the data whose fields are equal to the criteria, ordered
+        by their identifiers.  The lookups are backed by an index for every
+        combination of the fields, built on the first lookup by them.  The
+        fields are expected not to change once the walker has fixed the
+        datum, or once the walk is over for data added by other means."""
+        if not criteria:
+            return self.get()
+        fields = tuple(sorted(criteria))
+        index = self.indexes.get(fields)
+        if index is None:
+            index = self.indexes[fields] = FieldIndex(fields)
+        index.update(self)
+        retval = index.lookup(tuple(criteria[k] for k in fields))
+        retval.sort(key=_sort_key)
+        return retval
+
+    def lookup(self, *id_values):
+        """Returns the datum whose identifiers are the values, or None."""
+        for datum in self.data:
+            id_fields = datum._tableau_id_fields
+            break
+        else:
+            return None
+        if len(id_values) != len(id_fields):
+            raise ValueError("%s is identified by %d field(s) (%d given)" % (self.schema, len(id_fields), len(id_values)))
+        for datum in self.find(**dict(zip(id_fields, id_values))):
+            return datum
+        return None
+
+    def mark(self):
+        """Returns the number of the data ever added to the set."""
+        return self.log_base + len(self.log)
+
+    def since(self, mark):
+        """Returns the data added after the mark, ordered by their
+        identifiers.  The data drained since then are not included."""
+        return sorted(self.log[max(mark - self.log_base, 0):], key=_sort_key)
+
+class DataSetDelta(object):
+    """The data added to a data set after a checkpoint."""
+
+    def __init__(self, schema, data):
+        self.schema = schema
+        self.data = data
+
+    def get(self):
+        return list(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+class DataSuiteCheckpoint(object):
+    """Remembers how many data each data set of a suite had at a point."""
+
+    def __init__(self, marks):
+        self.marks = marks
+
+    def mark_of(self, schema):
+        return self.marks.get(schema, 0)
+
+class CyclicReferenceError(ValueError):
+    def __init__(self, cycle):
+        ValueError.__init__(self, "cyclic references among schemas: %s" % ' -> '.join(str(schema) for schema in cycle + cycle[0:1]))
+        self.cycle = cycle
+
 class ReferenceGraph(object):
     def __init__(self):
         self.references = {}
         self.back_references = {}
-        self.weight_cache = None
+        self.order = {}
+        self.levels_cache = None
+
+    def _add_node(self, node):
+        if node not in self.order:
+            self.order[node] = len(self.order)
+            self.references[node] = set()
+            self.levels_cache = None
 
     def add_reference(self, referencing, referenced):
-        references = self.references.setdefault(referencing, set())
+        self._add_node(referencing)
         if referenced is not None:
-            references.add(referenced)
-            self.back_references.setdefault(referenced, set()).add(referencing)
-        self.weight_cache = None
-
-    def get_weight(self, referenced):
-        return self._get_weight(referenced, set())
-
-    def _get_weight(self, referenced, seen):
-        if self.weight_cache is not None:
-            weight = self.weight_cache.get(referenced)
-            if weight is not None:
-                return weight
-        if referenced in seen:
-            return 0
-        seen.add(referenced)
-        weight = 1
-        back_references = self.back_references.get(referenced)
-        if back_references is not None:
-            for referencing in back_references:
-                weight += self._get_weight(referencing, seen)
-        if self.weight_cache is None:
-            self.weight_cache = {}
-        self.weight_cache[referenced] = weight
-        return weight
+            self._add_node(referenced)
+            references = self.references[referencing]
+            if referenced not in references:
+                references.add(referenced)
+                self.back_references.setdefault(referenced, set()).add(referencing)
+                self.levels_cache = None
+
+    def _find_cycle(self, remaining):
+        order = self.order
+        node = min(remaining, key=order.__getitem__)
+        path = []
+        positions = {}
+        while node not in positions:
+            positions[node] = len(path)
+            path.append(node)
+            node = min((referenced for referenced in self.references[node] if referenced in remaining and referenced != node), key=order.__getitem__)
+        return path[positions[node]:]
+
+    def get_levels(self):
+        """Returns the schemas grouped by dependency level; the schemas
+        in a level only depend on those in the preceding levels.  Schemas
+        within a level are ordered by their first appearance.  References
+        from a schema to itself are ignored."""
+        if self.levels_cache is not None:
+            return self.levels_cache
+        order = self.order
+        num_dependencies = {}
+        for node, references in self.references.iteritems():
+            num_dependencies[node] = len(references) - (node in references)
+        level = sorted((node for node, n in num_dependencies.iteritems() if n == 0), key=order.__getitem__)
+        levels = []
+        num_sorted = 0
+        while level:
+            levels.append(level)
+            num_sorted += len(level)
+            next_level = []
+            for referenced in level:
+                for referencing in self.back_references.get(referenced, ()):
+                    if referencing == referenced:
+                        continue
+                    n = num_dependencies[referencing] - 1
+                    num_dependencies[referencing] = n
+                    if n == 0:
+                        next_level.append(referencing)
+            next_level.sort(key=order.__getitem__)
+            level = next_level
+        if num_sorted != len(order):
+            raise CyclicReferenceError(self._find_cycle(set(node for node, n in num_dependencies.iteritems() if n > 0)))
+        self.levels_cache = levels
+        return levels
 
     def getlist(self):
-        return sorted(self.references.iterkeys(),
-                lambda a, b: \
-                    cmp(self.get_weight(a),
-                         self.get_weight(b)))
+        """Returns the schemas in the order that every schema comes after
+        the ones it depends on."""
+        return [node for level in self.get_levels() for node in level]
 
 class DataSuite(object):
-    def __init__(self):
+    """A collection of data sets.  allocators, if given, is either a
+    dictionary from schemas to the IDAllocator of their data sets, or a
+    callable that returns the allocator for a schema (or None to fall
+    back to a sequential allocator starting at 1).  observer, if given,
+    is notified of the data added to the data sets (see
+    tableau.instrumentation).  store, if given, makes the data sets
+    keep their data on disk (see tableau.staging).
+
+    natural_keys, if given, is either a dictionary from schemas to the
+    names of the fields that identify their data by value, or a callable
+    that returns them for a schema (or None).  Data equivalent to a
+    datum already in the suite are then left out, along with the data
+    only reachable from them, and the relations to them are rewritten to
+    refer to the datum in the suite.  The many_to_one relations of such
+    data are walked before they are added, so that the natural keys can
+    include the foreign key fields."""
+
+    def __init__(self, allocators=None, observer=None, store=None, natural_keys=None):
         self.datasets = {}
         self.digraph = ReferenceGraph()
+        self.allocators = allocators
+        self.foreign_keys = {}
+        self.observer = observer
+        self.store = store
+        self.natural_keys = natural_keys
+        self.walking = 0
+
+    def allocator_for(self, schema):
+        if self.allocators is None:
+            return None
+        elif isinstance(self.allocators, dict):
+            return self.allocators.get(schema)
+        else:
+            return self.allocators(schema)
+
+    def natural_key_for(self, schema):
+        if self.natural_keys is None:
+            return None
+        elif isinstance(self.natural_keys, dict):
+            return self.natural_keys.get(schema)
+        else:
+            return self.natural_keys(schema)
 
     def add_dependency(self, depending, depended_on):
         self.digraph.add_reference(depending, depended_on)
 
+    def add_foreign_key(self, schema, field, referenced_schema, referenced_field):
+        """Records that the walker copied the values of the field from
+        those of referenced_field of the data in referenced_schema."""
+        key = (schema, field)
+        references = self.foreign_keys.get(key)
+        if references is None:
+            references = self.foreign_keys[key] = set()
+        references.add((referenced_schema, referenced_field))
+
     def __getitem__(self, schema):
         dataset = self.datasets.get(schema)
         if dataset is None:
             self.digraph.add_reference(schema, None)
-            dataset = DataSet(schema)
+            if self.store is not None:
+                dataset = self.store.new_dataset(schema, self.allocator_for(schema), self.observer, self.natural_key_for(schema))
+            else:
+                dataset = DataSet(schema, self.allocator_for(schema), self.observer, self.natural_key_for(schema))
+            dataset.suite = self
             self.datasets[schema] = dataset
         return dataset
 
     def __iter__(self):
-        for schema in reversed(self.digraph.getlist()):
-            yield self.datasets[schema]
+        for schema in self.digraph.getlist():
+            dataset = self.datasets.get(schema)
+            if dataset is not None:
+                yield dataset
+
+    def find(self, schema, **criteria):
+        """Returns the data of the schema whose fields are equal to the
+        criteria.  See DataSet.find()."""
+        dataset = self.datasets.get(schema)
+        if dataset is None:
+            return []
+        return dataset.find(**criteria)
+
+    def lookup(self, schema, *id_values):
+        """Returns the datum of the schema whose identifiers are the
+        values, or None."""
+        dataset = self.datasets.get(schema)
+        if dataset is None:
+            return None
+        return dataset.lookup(*id_values)
+
+    def checkpoint(self):
+        """Returns a checkpoint, to be passed to since() later on."""
+        return DataSuiteCheckpoint(dict((schema, dataset.mark()) for schema, dataset in self.datasets.iteritems()))
+
+    def since(self, checkpoint):
+        """Iterates over the data added after the checkpoint, grouped by
+        data set in the dependency order just like iterating over the
+        suite itself."""
+        for dataset in self:
+            data = dataset.since(checkpoint.mark_of(dataset.schema))
+            if data:
+                yield DataSetDelta(dataset.schema, data)
+
+    def save_snapshot(self, path, key=None, compress=False):
+        """Saves the suite to a snapshot file.  See tableau.snapshot."""
+        from tableau.snapshot import save_snapshot
+        save_snapshot(self, path, key, compress)
+
+    @classmethod
+    def load_snapshot(cls, path, key=None):
+        """Loads a suite from the snapshot file, or returns None if there's
+        no snapshot for the key.  See tableau.snapshot."""
+        from tableau.snapshot import load_snapshot
+        return load_snapshot(path, key, cls)
 
 class DataWalker(object):
+    """Walks the object graph reachable from a datum and adds every datum
+    to the suite.  The walk is driven by an explicit stack of generators
+    rather than by recursion, so the depth of the graph is not bounded by
+    the interpreter's recursion limit; each relation handler yields the
+    walks of the related data and resumes once they are complete.
+
+    observer, which defaults to the observer of the suite, is told the
+    time spent walking each root and in each relation handler."""
+
     logger = logging.getLogger('tableau.DataWalker')
 
-    def __init__(self, suite):
+    def __init__(self, suite, observer=None):
         self.suite = suite
+        if observer is None:
+            observer = getattr(suite, 'observer', None)
+        self.observer = observer
+        if observer is not None:
+            for kind in ('one_to_many', 'many_to_many', 'many_to_one'):
+                name = '_handle_' + kind
+                setattr(self, name, self._observed_handler(kind, getattr(self, name)))
+
+    def _observed_handler(self, kind, handler):
+        observer = self.observer
+        def observed_handler(datum, name, value):
+            elapsed = 0.
+            task = handler(datum, name, value)
+            while True:
+                start = default_timer()
+                try:
+                    subtask = task.next()
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += default_timer() - start
+                yield subtask
+            observer.relation_handled(kind, datum._tableau_schema, name, elapsed)
+        return observed_handler
 
     def _handle_one_to_many(self, datum, name, value):
+        schema = datum._tableau_schema
+        id_fields = datum._tableau_id_fields
+        referring_fields = value.referring_fields
+        referred_fields = value.referred_fields
+        if referring_fields is not None:
+            if referred_fields is not None:
+                if len(referring_fields) != len(referred_fields):
+                    raise ValueError("%s.%s: len(referring_fields) != len(referred_fields) (%d != %d)" % (schema, name, len(referring_fields), len(referred_fields)))
+            else:
+                if len(referring_fields) != len(id_fields):
+                    raise ValueError("%s.%s: len(referring_fields) != len(_tableau_id_fields) (%d != %d)" % (schema, name, len(referring_fields), len(id_fields)))
+        dependent_schema = None
+        recorded = None
         for _datum in iter(value()):
-            self.suite.add_dependency(_datum._tableau_schema, datum._tableau_schema)
-            referring_fields = value.referring_fields
-            referred_fields = value.referred_fields
+            _fields = _datum._tableau_fields
+            _schema = _datum._tableau_schema
+            if _schema != dependent_schema:
+                self.suite.add_dependency(_schema, schema)
+                dependent_schema = _schema
+                recorded = None
             m = {}
             if referring_fields is not None:
-                if referred_fields is not None:
-                    if len(referring_fields) != len(referred_fields):
-                        raise ValueError("%s.%s: len(referring_fields) != len(referred_fields) (%d != %d)" % (datum._tableau_schema, name, len(referring_fields), len(referred_fields)))
-                else:
-                    if len(referring_fields) != len(datum._tableau_id_fields):
-                        raise ValueError("%s.%s: len(referring_fields) != len(_tableau_id_fields) (%d != %d)" % (datum._tableau_schema, name, len(referring_fields), len(datum._tableau_id_fields)))
-
                 for i, k in enumerate(referring_fields):
-                    v = _datum._tableau_fields.get(k)
+                    v = _fields.get(k)
                     if v is not None and isinstance(v, many_to_one):
-                        if v.schema is not None and v.schema != datum._tableau_schema:
-                            raise ValueError("field %s of datum %s is declared to asssociate it to %s while its container is %s" % (k, _datum, v.schema, datum._tableau_schema))
+                        if v.schema is not None and v.schema != schema:
+                            raise ValueError("field %s of datum %s is declared to asssociate it to %s while its container is %s" % (k, _datum, v.schema, schema))
                         if referred_fields is not None and (v.other_side_fields != referred_fields[i] and v.other_side_fields[0] != name):
-                            raise ValueError("field %s of datum %s is declared to asssociate it to %s via %s while expecting %s" % (k, _datum, datum._tableau_schema, v.other_side_field, referred_fields[i]))
+                            raise ValueError("field %s of datum %s is declared to asssociate it to %s via %s while expecting %s" % (k, _datum, schema, v.other_side_fields, referred_fields[i]))
                         m[k] = v.other_side_fields[i]
                     else:
                         if referred_fields is None:
-                            m[k] = datum._tableau_id_fields[i]
+                            m[k] = id_fields[i]
                         else:
                             m[k] = referred_fields[i]
             else:
                 rel = None
-                for k, v in _datum._tableau_fields.items():
-                    if isinstance(v, many_to_one) and v.schema == datum._tableau_schema:
+                for k, v in _fields.items():
+                    if isinstance(v, many_to_one) and v.schema == schema:
                         if rel is not None:
-                            raise ValueError("datum %s has more than one many-to-one associations to %s" % (_datum, datum._tableau_schema))
+                            raise ValueError("datum %s has more than one many-to-one associations to %s" % (_datum, schema))
                         rel = v
                 if rel is None:
-                    raise ValueError("cannot determine the foreign key fields; datum %s has no explicit associations to %s." % (_datum, datum._tableau_schema))
-                other_side_fields = rel.other_side_fields or datum._tableau_id_fields
+                    raise ValueError("cannot determine the foreign key fields; datum %s has no explicit associations to %s." % (_datum, schema))
+                other_side_fields = rel.other_side_fields or id_fields
                 m = dict(zip(rel.this_side_fields, other_side_fields))
 
-            for k1, k2 in m.items():
+            for k1, k2 in m.iteritems():
                 setattr(_datum, k1, getattr(datum, k2))
-            self(_datum)
+            if m != recorded:
+                for k1, k2 in m.iteritems():
+                    self.suite.add_foreign_key(_schema, k1, schema, k2)
+                recorded = m
+            yield self._walk(_datum)
 
     def _handle_many_to_many(self, datum, name, value):
         for _datum in iter(value()):
-            self.suite.add_dependency(_datum._tableau_schema, datum._tableau_schema)
-            self(_datum)
+            if value.via is None:
+                # otherwise the intermediate datum depends on both sides
+                self.suite.add_dependency(_datum._tableau_schema, datum._tableau_schema)
+            yield self._walk(_datum)
+            _datum = self.suite[_datum._tableau_schema].canonical_of(_datum)
             these_field_values = tuple(getattr(datum, field) for field in datum._tableau_id_fields)
             those_field_values = tuple(getattr(_datum, field) for field in _datum._tableau_id_fields)
             if len(these_field_values) != len(value.this_side_fields):
@@ -166,6 +559,12 @@ class DataWalker(object):
             if len(those_field_values) != len(value.other_side_fields):
                 raise ValueError("%s.%s: number of other side's fields must be identical to the other side's datum's id fields" % (datum._tableau_schema, name))
             if value.via is not None:
+                self.suite.add_dependency(value.via, datum._tableau_schema)
+                self.suite.add_dependency(value.via, _datum._tableau_schema)
+                for k1, k2 in zip(value.this_side_fields, datum._tableau_id_fields):
+                    self.suite.add_foreign_key(value.via, k1, datum._tableau_schema, k2)
+                for k1, k2 in zip(value.other_side_fields, _datum._tableau_id_fields):
+                    self.suite.add_foreign_key(value.via, k1, _datum._tableau_schema, k2)
                 intermediate_datum = Datum(
                     value.via,
                     value.this_side_fields + value.other_side_fields,
@@ -176,22 +575,31 @@ class DataWalker(object):
                             )
                         )
                     )
-                self(intermediate_datum)
+                yield self._walk(intermediate_datum)
 
     def _handle_many_to_one(self, datum, name, value):
         if value.schema:
             self.suite.add_dependency(datum._tableau_schema, value.schema)
         _datum = value()
         if _datum is not None:
-            self(_datum)
+            yield self._walk(_datum)
+            canonical = self.suite[_datum._tableau_schema].canonical_of(_datum)
+            if canonical is not _datum:
+                value.value = _datum = canonical
+                if datum._tableau_fields.get(name) is value:
+                    # let SADatum update the mapped attribute as well
+                    setattr(datum, name, value)
         if value.this_side_fields is not None:
+            if _datum is not None:
+                other_side_fields = value.other_side_fields or _datum._tableau_id_fields
+                for k1, k2 in zip(value.this_side_fields, other_side_fields):
+                    self.suite.add_foreign_key(datum._tableau_schema, k1, _datum._tableau_schema, k2)
             if not value.rendered:
                 if _datum is not None:
-                    other_side_fields = value.other_side_fields or _datum._tableau_id_fields
                     if not other_side_fields:
                         raise ValueError("%s.%s: cannot determine other_side_fields" % (datum._tableau_schema, name))
                     if len(value.this_side_fields) != len(other_side_fields):
-                        raise ValueError("%s.%s: number of this_side fields doesn't match to that of other_side field (%d != %d)" % (datum._tableau_schema, name, len(self.this_side_fields), len(other_side_fields)))
+                        raise ValueError("%s.%s: number of this_side fields doesn't match to that of other_side field (%d != %d)" % (datum._tableau_schema, name, len(value.this_side_fields), len(other_side_fields)))
                     for k1, k2 in zip(value.this_side_fields, other_side_fields):
                         setattr(datum, k1, getattr(_datum, k2))
                 else:
@@ -200,18 +608,58 @@ class DataWalker(object):
 
     def _handle(self, datum, name, value):
         if isinstance(value, one_to_many):
-            self._handle_one_to_many(datum, name, value)
+            return self._handle_one_to_many(datum, name, value)
         elif isinstance(value, many_to_many):
-            self._handle_many_to_many(datum, name, value)
+            return self._handle_many_to_many(datum, name, value)
         elif isinstance(value, many_to_one):
-            self._handle_many_to_one(datum, name, value)
+            return self._handle_many_to_one(datum, name, value)
         elif isinstance(value, DynamicField):
-            self._handle(datum, name, value())
+            return self._handle(datum, name, value())
+        return None
 
-    def __call__(self, datum):
+    def _walk(self, datum):
         dataset = self.suite[datum._tableau_schema]
+        fields = datum._tableau_fields.items()
+        if dataset.natural_key is not None:
+            # the natural key may include the fields copied from the data
+            # referred to, so those relations are walked first
+            if datum in dataset:
+                return
+            rest = []
+            for k, v in fields:
+                if isinstance(v, many_to_one):
+                    task = self._handle(datum, k, v)
+                    if task is not None:
+                        yield task
+                else:
+                    rest.append((k, v))
+            fields = rest
         if dataset.add(datum):
-            for k, v in list(datum._tableau_fields.items()):
-                self._handle(datum, k, v)
+            for k, v in fields:
+                if isinstance(v, DynamicField):
+                    task = self._handle(datum, k, v)
+                    if task is not None:
+                        yield task
+            datum._tableau_fixed = True
             datum._tableau_on_fixation()
+
+    def __call__(self, datum):
+        observer = self.observer
+        if observer is not None:
+            start = default_timer()
+        stack = [self._walk(datum)]
+        push = stack.append
+        pop = stack.pop
+        suite = self.suite
+        suite.walking += 1
+        try:
+            while stack:
+                try:
+                    push(stack[-1].next())
+                except StopIteration:
+                    pop()
+        finally:
+            suite.walking -= 1
+        if observer is not None:
+            observer.phase_completed('walk', default_timer() - start)
         return datum
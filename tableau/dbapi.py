@@ -0,0 +1,90 @@
+# encoding: utf-8
+
+import logging
+from tableau.sql import extract_rows, MissingType
+
+__all__ = [
+    'DBAPILoader',
+    ]
+
+class DBAPILoader(object):
+    """Inserts the data in the suite straight into a DB-API connection in
+    the dependency order of the suite, binding the values as parameters
+    of executemany() instead of rendering them into SQL text.  Every
+    batch of up to batch_size rows that share the same columns is
+    committed as a transaction of its own."""
+
+    logger = logging.getLogger('tableau.DBAPILoader')
+
+    def __init__(self, connection, paramstyle='qmark', batch_size=1000, identifier_quote='`', normalize_columns=False):
+        if paramstyle not in ('qmark', 'numeric', 'named', 'format', 'pyformat'):
+            raise ValueError("Unsupported paramstyle: %s" % paramstyle)
+        self.connection = connection
+        self.paramstyle = paramstyle
+        self.batch_size = batch_size
+        self.identifier_quote = identifier_quote
+        self.normalize_columns = normalize_columns
+        self.shapes = {}
+        self.statements = {}
+
+    def put_identifier(self, name):
+        return '%s%s%s' % (self.identifier_quote, name, self.identifier_quote)
+
+    def put_placeholder(self, i):
+        if self.paramstyle == 'qmark':
+            return '?'
+        elif self.paramstyle == 'numeric':
+            return ':%d' % (i + 1)
+        elif self.paramstyle == 'named':
+            return ':p%d' % i
+        elif self.paramstyle == 'format':
+            return '%s'
+        else:
+            return '%%(p%d)s' % i
+
+    def get_statement(self, table, columns):
+        key = (table, columns)
+        statement = self.statements.get(key)
+        if statement is None:
+            statement = self.statements[key] = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                self.put_identifier(table),
+                ', '.join(self.put_identifier(k) for k in columns),
+                ', '.join(self.put_placeholder(i) for i in range(len(columns))))
+        return statement
+
+    def bind_values(self, values):
+        values = [None if isinstance(v, MissingType) else v for v in values]
+        if self.paramstyle in ('named', 'pyformat'):
+            return dict(('p%d' % i, v) for i, v in enumerate(values))
+        else:
+            return tuple(values)
+
+    def execute(self, cursor, table, columns, batch):
+        statement = self.get_statement(table, columns)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('Inserting %d rows into %s' % (len(batch), table))
+        try:
+            cursor.executemany(statement, batch)
+        except:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+
+    def __call__(self, suite):
+        cursor = self.connection.cursor()
+        try:
+            for dataset in suite:
+                prev_table = None
+                prev_columns = None
+                batch = []
+                for table, columns, values in extract_rows(self.shapes, dataset, self.normalize_columns):
+                    if batch and (len(batch) >= self.batch_size or prev_table != table or prev_columns != columns):
+                        self.execute(cursor, prev_table, prev_columns, batch)
+                        batch = []
+                    batch.append(self.bind_values(values))
+                    prev_table = table
+                    prev_columns = columns
+                if batch:
+                    self.execute(cursor, prev_table, prev_columns, batch)
+        finally:
+            cursor.close()
@@ -1,5 +1,7 @@
 from tableau.utils import is_iterable_container, string_container_from_value, _repr
 from inspect import getargspec
+from weakref import WeakKeyDictionary
+from timeit import default_timer
 
 __all__ = [
     'DynamicField',
@@ -9,6 +11,7 @@ __all__ = [
     'one_to_many',
     'auto',
     'unspecified',
+    'memoized',
     ]
 
 class UnspecifiedType(object):
@@ -31,6 +34,22 @@ class DynamicField(object):
     def __call__(self):
         pass
 
+_argspec_cache = WeakKeyDictionary()
+
+def argspec_of(func):
+    """Returns the argspec of the function, which is computed only once
+    per function object."""
+    try:
+        return _argspec_cache[func]
+    except (KeyError, TypeError):
+        pass
+    argspec = getargspec(func)
+    try:
+        _argspec_cache[func] = argspec
+    except TypeError:
+        pass
+    return argspec
+
 class Lazy(DynamicField):
     rendered = True
 
@@ -38,19 +57,93 @@ class Lazy(DynamicField):
         self.func = func
         self.container = None
         self.name = None
-        self.argspec = getargspec(self.func)
+        self.argspec = argspec_of(self.func)
 
     def bind(self, container, name):
         self.container = container
         self.name = name
 
-    def __call__(self):
+    observer = None
+
+    def apply(self, container):
         if self.argspec.varargs is not None:
-            return self.func(*(self.container, self.name))
+            return self.func(*(container, self.name))
         elif self.argspec.keywords is not None:
-            return self.func(**dict(container=self.container, name=self.name))
+            return self.func(**dict(container=container, name=self.name))
         else:
-            return self.func(*(self.container, self.name)[0:len(self.argspec.args)])
+            return self.func(*(container, self.name)[0:len(self.argspec.args)])
+
+    def observed_apply(self, container):
+        start = default_timer()
+        try:
+            return self.apply(container)
+        finally:
+            Lazy.observer.lazy_evaluated(getattr(container, '_tableau_schema', None), self.name, default_timer() - start)
+
+    # switched to observed_apply by tableau.instrumentation.observe_lazy()
+    invoke = apply
+
+    def __call__(self):
+        return self.invoke(self.container)
+
+class ReadRecorder(object):
+    """Stands in for the container while a memoized function is being
+    evaluated, recording the fields read through it."""
+
+    __slots__ = ('_tableau_container', '_tableau_reads')
+
+    def __init__(self, container):
+        object.__setattr__(self, '_tableau_container', container)
+        object.__setattr__(self, '_tableau_reads', [])
+
+    def __getattr__(self, k):
+        v = getattr(self._tableau_container, k)
+        if not k.startswith('_'):
+            self._tableau_reads.append((k, v))
+        return v
+
+    def __setattr__(self, k, v):
+        setattr(self._tableau_container, k, v)
+
+class memoized(Lazy):
+    """A Lazy field whose value is cached once its container has been
+    fixed by the walker.  The function receives a stand-in for the
+    container that records the fields read through it, and the cached
+    value is discarded as soon as any of those fields has been assigned
+    a different value."""
+
+    def __init__(self, func):
+        Lazy.__init__(self, func)
+        self.reads = None
+        self.value = None
+
+    def bind(self, container, name):
+        Lazy.bind(self, container, name)
+        self.reads = None
+        self.value = None
+
+    def _is_valid(self):
+        container = self.container
+        for k, v in self.reads:
+            try:
+                _v = getattr(container, k)
+            except AttributeError:
+                return False
+            if _v is not v and _v != v:
+                return False
+        return True
+
+    def __call__(self):
+        if self.reads is not None and self._is_valid():
+            return self.value
+        container = self.container
+        if not getattr(container, '_tableau_fixed', False):
+            return self.invoke(container)
+        recorder = ReadRecorder(container)
+        value = self.invoke(recorder)
+        self.reads = recorder._tableau_reads
+        self.value = value
+        return value
 
 class many_to_one(DynamicField):
     def __init__(self, schema_or_value=unspecified, this_side_fields=None, other_side_fields=None):
@@ -0,0 +1,143 @@
+# encoding: utf-8
+
+"""Hooks for observing what the walker and the SQL generators are doing.
+
+An Observer is handed to DataSuite, DataWalker or SQLGenerator through
+their observer argument (a walker picks up the observer of its suite by
+default), and observe_lazy() installs one for the evaluation of every
+Lazy field.  Nothing is measured unless an observer is given, so the
+hooks cost no more than a test against None when unused.
+
+MetricsCollector is an observer that keeps the numbers in memory and
+summarizes them::
+
+    collector = MetricsCollector()
+    observe_lazy(collector)
+    suite = DataSuite(observer=collector)
+    DataWalker(suite)(root)
+    SQLGenerator(out, observer=collector)(suite)
+    observe_lazy(None)
+    print collector.summary()
+"""
+
+from tableau.declarations import Lazy
+
+__all__ = [
+    'Observer',
+    'MetricsCollector',
+    'observe_lazy',
+    ]
+
+class Observer(object):
+    """The interface of the observers; every method does nothing here."""
+
+    def datum_added(self, schema, datum):
+        """Called when a datum is added to the data set of the schema."""
+
+    def data_drained(self, schema, count):
+        """Called when count data are drained from the data set, or
+        spilled out of memory by a staged data set (see tableau.staging)."""
+
+    def relation_handled(self, kind, schema, name, elapsed):
+        """Called when the walker is done with the relation held by the
+        field of the name of a datum of the schema; kind is one of
+        'one_to_many', 'many_to_many' and 'many_to_one'.  elapsed is the
+        time spent in the handler itself, excluding the walks of the
+        related data."""
+
+    def lazy_evaluated(self, schema, name, elapsed):
+        """Called when a Lazy field has been evaluated."""
+
+    def statement_flushed(self, table, nbytes):
+        """Called when a statement of nbytes bytes has been written."""
+
+    def phase_completed(self, phase, elapsed):
+        """Called when a phase, either 'walk' (of a single root) or 'emit'
+        (of a suite or of the data of a root when streaming), is over."""
+
+def observe_lazy(observer):
+    """Makes every Lazy field report its evaluation to the observer, or
+    stops doing so if observer is None.  Returns the previous observer."""
+    previous = Lazy.observer
+    Lazy.observer = observer
+    if observer is None:
+        Lazy.invoke = Lazy.__dict__['apply']
+    else:
+        Lazy.invoke = Lazy.__dict__['observed_apply']
+    return previous
+
+class MetricsCollector(Observer):
+    """Accumulates the counts and the timings in memory."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.rows = {}
+        self.relations = {}
+        self.lazy_fields = {}
+        self.statements = {}
+        self.phases = {}
+        self.size = 0
+        self.peak_size = 0
+
+    def _accumulate(self, metrics, key, value):
+        pair = metrics.get(key)
+        if pair is None:
+            metrics[key] = [1, value]
+        else:
+            pair[0] += 1
+            pair[1] += value
+
+    def datum_added(self, schema, datum):
+        self.rows[schema] = self.rows.get(schema, 0) + 1
+        self.size += 1
+        if self.size > self.peak_size:
+            self.peak_size = self.size
+
+    def data_drained(self, schema, count):
+        self.size -= count
+
+    def relation_handled(self, kind, schema, name, elapsed):
+        self._accumulate(self.relations, (kind, schema, name), elapsed)
+
+    def lazy_evaluated(self, schema, name, elapsed):
+        self._accumulate(self.lazy_fields, (schema, name), elapsed)
+
+    def statement_flushed(self, table, nbytes):
+        self._accumulate(self.statements, table, nbytes)
+
+    def phase_completed(self, phase, elapsed):
+        self._accumulate(self.phases, phase, elapsed)
+
+    @property
+    def bytes_written(self):
+        return sum(pair[1] for pair in self.statements.itervalues())
+
+    @property
+    def statements_flushed(self):
+        return sum(pair[0] for pair in self.statements.itervalues())
+
+    def summary(self):
+        """Returns a report of the metrics as a string."""
+        lines = []
+        lines.append('rows (peak suite size: %d)' % self.peak_size)
+        for schema, count in sorted(self.rows.iteritems()):
+            lines.append('  %-40s %10d' % (schema, count))
+        if self.relations:
+            lines.append('relations (by time spent)')
+            for (kind, schema, name), (count, elapsed) in sorted(self.relations.iteritems(), key=lambda pair: -pair[1][1]):
+                lines.append('  %-40s %10d %10.4fs' % ('%s.%s (%s)' % (schema, name, kind), count, elapsed))
+        if self.lazy_fields:
+            lines.append('lazy fields (by time spent)')
+            for (schema, name), (count, elapsed) in sorted(self.lazy_fields.iteritems(), key=lambda pair: -pair[1][1]):
+                lines.append('  %-40s %10d %10.4fs' % ('%s.%s' % (schema, name), count, elapsed))
+        if self.statements:
+            lines.append('statements (%d, %d bytes)' % (self.statements_flushed, self.bytes_written))
+            for table, (count, nbytes) in sorted(self.statements.iteritems()):
+                lines.append('  %-40s %10d %10d bytes' % (table, count, nbytes))
+        if self.phases:
+            lines.append('phases')
+            for phase, (count, elapsed) in sorted(self.phases.iteritems()):
+                lines.append('  %-40s %10d %10.4fs' % (phase, count, elapsed))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,193 @@
+# encoding: utf-8
+
+"""Walks independent roots in several processes and merges the results.
+
+ParallelWalker splits a sequence of arguments into contiguous partitions,
+one per process.  Each process builds the roots out of its arguments
+with a module-level function, walks them into a suite of its own, and
+reports how many data of every schema with auto identifiers it has.
+Once every process has reported, the identifiers of each partition are
+shifted past those of the preceding partitions, together with the
+foreign key fields the walker copied them to, so that the merged suite
+holds the same rows as a serial walk of the roots in the same order
+would.  The rows are sent back to the parent rendered, and the merged
+suite is made of plain Datum objects just like a suite loaded from a
+snapshot (see tableau.snapshot).
+
+The roots must be independent of each other; data reachable from roots
+in different partitions are never identified with each other.
+"""
+
+import sys
+import traceback
+import multiprocessing
+from tableau.declarations import DynamicField, auto
+from tableau.dataset import DataSuite, DataWalker
+from tableau.snapshot import dump_suite, merge_suite
+
+__all__ = [
+    'ParallelWalker',
+    ]
+
+def _auto_fields_of(suite):
+    retval = {}
+    for schema, dataset in suite.datasets.iteritems():
+        for datum in dataset.data:
+            if isinstance(datum._tableau_id_fields, auto):
+                retval[schema] = datum._tableau_id_fields[0]
+            break
+    return retval
+
+def _resolve_foreign_key(foreign_keys, auto_fields, key):
+    """Returns the schema whose auto identifiers the field designated by
+    key ends up holding, or None."""
+    resolved = set()
+    pending = [key]
+    seen = set(pending)
+    while pending:
+        key = pending.pop()
+        for referenced in foreign_keys.get(key, ()):
+            if auto_fields.get(referenced[0]) == referenced[1]:
+                resolved.add(referenced[0])
+            elif referenced not in seen:
+                seen.add(referenced)
+                pending.append(referenced)
+    if len(resolved) > 1:
+        raise ValueError("%s.%s refers to the identifiers of more than one schema: %s" % (key[0], key[1], ', '.join(sorted(resolved))))
+    for schema in resolved:
+        return schema
+    return None
+
+def shift_identifiers(suite, offsets):
+    """Adds the offset of each schema to the auto identifiers of its data
+    and to the foreign key fields that refer to them."""
+    auto_fields = _auto_fields_of(suite)
+    shifts = {}
+    for schema, field in auto_fields.iteritems():
+        shifts.setdefault(schema, []).append((field, schema))
+    for key in suite.foreign_keys:
+        if auto_fields.get(key[0]) == key[1]:
+            continue
+        referenced_schema = _resolve_foreign_key(suite.foreign_keys, auto_fields, key)
+        if referenced_schema is not None:
+            shifts.setdefault(key[0], []).append((key[1], referenced_schema))
+    for schema, fields in shifts.iteritems():
+        dataset = suite.datasets.get(schema)
+        if dataset is None:
+            continue
+        fields = [(k, offsets.get(_schema, 0)) for k, _schema in fields]
+        fields = [pair for pair in fields if pair[1]]
+        if not fields:
+            continue
+        for datum in dataset.data:
+            _fields = datum._tableau_fields
+            for k, offset in fields:
+                v = _fields.get(k)
+                if v is not None and not isinstance(v, DynamicField):
+                    setattr(datum, k, v + offset)
+        if dataset.seq is not None and schema in offsets:
+            dataset.seq += offsets[schema]
+
+def _walk_partition(connection, build_root, args):
+    try:
+        suite = DataSuite()
+        walker = DataWalker(suite)
+        for arg in args:
+            walker(build_root(arg))
+        counts = dict((schema, len(suite.datasets[schema].data)) for schema in _auto_fields_of(suite))
+        digraph = suite.digraph
+        connection.send((True, (
+            counts,
+            sorted(digraph.order, key=digraph.order.__getitem__),
+            suite.foreign_keys,
+            )))
+        offsets = connection.recv()
+        shift_identifiers(suite, offsets)
+        connection.send((True, dump_suite(suite)))
+    except:
+        connection.send((False, ''.join(traceback.format_exception(*sys.exc_info()))))
+    connection.close()
+
+class ParallelWalker(object):
+    """Builds the roots out of the arguments with build_root, walks them
+    in up to the given number of processes and merges the data into the
+    suite.  build_root has to be a module-level function unless the
+    processes are forked.  The data sets of the schemas with auto
+    identifiers must use sequential allocators (the default); the
+    identifiers of the merged data follow those already in the suite."""
+
+    def __init__(self, suite, processes=None):
+        self.suite = suite
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+
+    def partition(self, args):
+        args = list(args)
+        n = max(min(self.processes, len(args)), 1)
+        size, remainder = divmod(len(args), n)
+        retval = []
+        start = 0
+        for i in range(0, n):
+            end = start + size + (i < remainder)
+            retval.append(args[start:end])
+            start = end
+        return retval
+
+    def receive(self, connection):
+        try:
+            succeeded, result = connection.recv()
+        except EOFError:
+            raise RuntimeError("walker process exited unexpectedly")
+        if not succeeded:
+            raise RuntimeError("walker process failed:\n%s" % result)
+        return result
+
+    def offsets_for(self, reports):
+        suite = self.suite
+        for counts, nodes, foreign_keys in reports:
+            for node in nodes:
+                suite.add_dependency(node, None)
+            for key, references in foreign_keys.iteritems():
+                for referenced in references:
+                    suite.add_foreign_key(key[0], key[1], referenced[0], referenced[1])
+        bases = {}
+        retval = []
+        for counts, nodes, foreign_keys in reports:
+            offsets = {}
+            for schema, count in counts.iteritems():
+                base = bases.get(schema)
+                if base is None:
+                    seq = suite[schema].seq
+                    if seq is None:
+                        raise ValueError("data set for %s doesn't allocate identifiers sequentially" % schema)
+                    base = seq - 1
+                offsets[schema] = base
+                bases[schema] = base + count
+            retval.append(offsets)
+        return retval
+
+    def __call__(self, build_root, args):
+        workers = []
+        try:
+            for partition in self.partition(args):
+                connection, child_connection = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=_walk_partition, args=(child_connection, build_root, partition))
+                process.daemon = True
+                process.start()
+                child_connection.close()
+                workers.append((process, connection))
+            reports = [self.receive(connection) for process, connection in workers]
+            for offsets, (process, connection) in zip(self.offsets_for(reports), workers):
+                connection.send(offsets)
+            for process, connection in workers:
+                merge_suite(self.suite, self.receive(connection))
+        except:
+            for process, connection in workers:
+                process.terminate()
+            raise
+        finally:
+            for process, connection in workers:
+                connection.close()
+                process.join()
+        return self.suite
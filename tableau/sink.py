@@ -0,0 +1,110 @@
+# encoding: utf-8
+
+"""Pipes the output of SQLGenerator into a loader process.
+
+A PipeSink is a file-like object that the generator writes into.  The
+output is cut into chunks that a thread of its own writes to the
+stream, so the generator goes on rendering while the loader is busy
+reading; once max_chunks chunks are waiting, write() blocks until the
+loader catches up::
+
+    sink = spawn_loader(['mysql', 'test'], encoding='utf-8')
+    try:
+        SQLGenerator(sink)(suite)
+    finally:
+        sink.close()
+
+close() waits for the loader to exit and raises CalledProcessError if it
+failed.  An error that occurs while writing to the stream, such as a
+broken pipe, is raised from the next write() or from close().
+"""
+
+import threading
+import subprocess
+from Queue import Queue
+
+__all__ = [
+    'PipeSink',
+    'spawn_loader',
+    ]
+
+class PipeSink(object):
+    """Writes the output to the stream in a thread of its own, buffering
+    up to max_chunks chunks of about chunk_size bytes.  If process is
+    given, close() closes the stream and waits for the process, which
+    was started with args."""
+
+    def __init__(self, stream, encoding=None, chunk_size=65536, max_chunks=16, process=None, args=None):
+        self.stream = stream
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.process = process
+        self.args = args
+        self.queue = Queue(max_chunks)
+        self.buffer = []
+        self.buffered = 0
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._drain)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def _drain(self):
+        queue = self.queue
+        while True:
+            chunk = queue.get()
+            if chunk is None:
+                break
+            if self.error is not None:
+                # keep on taking the chunks so that write() never blocks
+                continue
+            try:
+                self.stream.write(chunk)
+            except Exception, e:
+                self.error = e
+        if self.error is None:
+            try:
+                self.stream.flush()
+            except Exception, e:
+                self.error = e
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, data):
+        self._raise_error()
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.queue.put(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        if self.process is not None:
+            try:
+                self.stream.close()
+            except IOError:
+                pass
+            returncode = self.process.wait()
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, self.args)
+        self._raise_error()
+
+def spawn_loader(args, encoding=None, chunk_size=65536, max_chunks=16, **kwargs):
+    """Starts the loader process with the arguments, along with the
+    keyword arguments to subprocess.Popen, and returns a PipeSink that
+    writes into its standard input."""
+    process = subprocess.Popen(args, stdin=subprocess.PIPE, **kwargs)
+    return PipeSink(process.stdin, encoding, chunk_size, max_chunks, process, args)
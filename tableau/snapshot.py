@@ -0,0 +1,168 @@
+# encoding: utf-8
+
+"""Saves walked suites to binary snapshot files and loads them back.
+
+A snapshot holds the rendered rows of every data set, the dependency
+graph of the suite and the state of the sequences of auto identifiers,
+so loading one skips both building the data and walking them.  The data
+in a loaded suite are plain Datum objects carrying the rendered values
+of the original ones; relations are reflected only in the values of the
+foreign key fields.
+
+Every snapshot is tagged with a key, typically computed by source_key()
+from the modules that define the fixtures, and load_snapshot() returns
+None unless the key of the file matches the requested one.
+"""
+
+import os
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+from tableau.containers import Datum
+from tableau.declarations import auto
+from tableau.dataset import DataSuite
+from tableau.sql import extract_rows
+
+__all__ = [
+    'source_key',
+    'dump_suite',
+    'restore_suite',
+    'merge_suite',
+    'save_snapshot',
+    'load_snapshot',
+    ]
+
+MAGIC = 'TABLEAU-SNAPSHOT 1\n'
+
+def source_key(*sources):
+    """Computes a key from the contents of the sources, each of which is
+    either a module, a path to a file or a string."""
+    digest = sha1(MAGIC)
+    for source in sources:
+        if hasattr(source, '__file__'):
+            path = source.__file__
+            if path.endswith(('.pyc', '.pyo')):
+                path = path[:-1]
+            source = path
+        if isinstance(source, basestring) and os.path.isfile(source):
+            f = open(source, 'rb')
+            try:
+                digest.update(f.read())
+            finally:
+                f.close()
+        else:
+            if isinstance(source, unicode):
+                source = source.encode('utf-8')
+            digest.update(str(source))
+        digest.update('\0')
+    return digest.hexdigest()
+
+def dump_suite(suite):
+    """Turns the suite into a structure of plain built-in objects."""
+    digraph = suite.digraph
+    order = digraph.order
+    shapes = {}
+    datasets = []
+    for dataset in suite:
+        id_fields = None
+        segments = []
+        columns_ = None
+        rows = None
+        for datum in dataset:
+            id_fields = datum._tableau_id_fields
+            break
+        for table, columns, values in extract_rows(shapes, dataset):
+            if columns is not columns_:
+                rows = []
+                segments.append((columns, rows))
+                columns_ = columns
+            rows.append(tuple(values))
+        datasets.append((
+            dataset.schema,
+            isinstance(id_fields, auto),
+            id_fields is not None and tuple(id_fields) or (),
+            dataset.seq,
+            segments
+            ))
+    return {
+        'nodes': sorted(order, key=order.__getitem__),
+        'references': [(referencing, sorted(references, key=order.__getitem__)) for referencing, references in digraph.references.iteritems()],
+        'datasets': datasets,
+        }
+
+def restore_suite(dumped, suite_class=DataSuite):
+    """Builds a suite from the structure made by dump_suite()."""
+    return merge_suite(suite_class(), dumped)
+
+def merge_suite(suite, dumped):
+    """Adds the data and the dependencies in the structure made by
+    dump_suite() to the suite.  The identifiers of the data must not
+    collide with those of the data already in the suite."""
+    for node in dumped['nodes']:
+        suite.add_dependency(node, None)
+    for referencing, references in dumped['references']:
+        for referenced in references:
+            suite.add_dependency(referencing, referenced)
+    new = object.__new__
+    for schema, is_auto, id_fields, seq, segments in dumped['datasets']:
+        if is_auto:
+            id_fields = auto(id_fields[0])
+        data = []
+        for columns, rows in segments:
+            for values in rows:
+                datum = new(Datum)
+                datum.__dict__ = {
+                    '_tableau_schema': schema,
+                    '_tableau_id_fields': id_fields,
+                    '_tableau_fields': dict(zip(columns, values)),
+                    '_tableau_fixed': True,
+                    }
+                data.append(datum)
+        dataset = suite[schema]
+        if seq is not None and dataset.seq is not None:
+            seq = max(seq, dataset.seq)
+        dataset.restore(data, seq)
+    return suite
+
+def save_snapshot(suite, path, key=None, compress=False):
+    """Saves the suite to the file at the path, tagging it with the key."""
+    payload = pickle.dumps(dump_suite(suite), pickle.HIGHEST_PROTOCOL)
+    if compress:
+        payload = zlib.compress(payload, 1)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tmp_path, 'wb')
+    try:
+        f.write(MAGIC)
+        pickle.dump({'key': key, 'compressed': compress}, f, pickle.HIGHEST_PROTOCOL)
+        f.write(payload)
+    finally:
+        f.close()
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+def load_snapshot(path, key=None, suite_class=DataSuite):
+    """Loads the suite from the file at the path, or returns None if the
+    file doesn't exist or is tagged with another key."""
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return None
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        header = pickle.load(f)
+        if header['key'] != key:
+            return None
+        payload = f.read()
+    finally:
+        f.close()
+    if header['compressed']:
+        payload = zlib.decompress(payload)
+    return restore_suite(pickle.loads(payload), suite_class)
@@ -1,21 +1,27 @@
 # encoding: utf-8
 
+import os
+import re
 import logging
 import datetime
+from timeit import default_timer
 from tableau.declarations import DynamicField
+from tableau.dataset import DataSuite, DataWalker
 
 class InsertStmtBuilder(object):
     def __init__(self, builder):
         self.builder = builder
         self.prev_table = None
-        self.prev_keys = u''
+        self.prev_columns = None
         self.nbytes_sent = 0
 
     def flush(self):
         if self.prev_table is not None:
             self.write(";\n");
+            if self.builder.observer is not None:
+                self.builder.observer.statement_flushed(self.prev_table, self.nbytes_sent)
         self.prev_table = None
-        self.prev_keys = u''
+        self.prev_columns = None
         self.nbytes_sent = 0
 
     def write(self, str):
@@ -23,46 +29,202 @@ class InsertStmtBuilder(object):
         self.nbytes_sent += len(str)
 
     def __call__(self, table, _values):
-        encoding = self.builder.encoding
-        values = []
-        keys = u''
-        value_len = 0
-        for k, v in _values:
-            v_ = self.builder.put_scalar(v)
-            keys += k
-            values.append((k, v_))
-            value_len += len(v_)
+        put_scalar = self.builder.put_scalar
+        self.put_row(
+            table,
+            tuple(k for k, v in _values),
+            [put_scalar(v) for k, v in _values])
 
-        if self.nbytes_sent >= 131072:
+    def render_row(self, values):
+        """Lays out the values rendered by put_scalar() as a row."""
+        return "(" + ", ".join(values) + ")"
+
+    def _start_row(self, table, columns, row_len):
+        if self.nbytes_sent > 0 and \
+                self.nbytes_sent + row_len + 4 > self.builder.max_statement_size:
             self.flush() 
 
-        if self.prev_table != table or self.prev_keys != keys:
+        if self.prev_table != table or (self.prev_columns is not columns and self.prev_columns != columns):
             self.flush()
             self.write("INSERT INTO `%s` (%s) VALUES\n" % (
-                table.encode(encoding),
-                ', '.join(self.builder.put_identifier(k) for k, v in values)))
+                table.encode(self.builder.encoding),
+                self.builder.put_column_clause(columns)))
         else:
             self.write(",\n")
 
+    def put_rendered_row(self, table, columns, row):
+        """Writes a row laid out by render_row()."""
+        self._start_row(table, columns, len(row))
+        self.write(row)
+        self.prev_table = table
+        self.prev_columns = columns
+
+    def put_row(self, table, columns, values):
+        """Writes a row whose values are already rendered by put_scalar().
+        A new statement is started whenever the row would make the current
+        one exceed the builder's max_statement_size."""
+        value_len = 0
+        for v in values:
+            value_len += len(v)
+
+        self._start_row(table, columns, value_len + 2 * len(values))
+
         if value_len < 1024:
-            self.write("(" + ", ".join(v for _, v in values) + ")")
+            self.write("(" + ", ".join(values) + ")")
         else:
             self.write("(")
             first = True
-            for _, v in values:
+            for v in values:
                 if not first:
                     self.write(", ")
                 self.write(v)
                 first = False
             self.write(")")
         self.prev_table = table
-        self.prev_keys = keys
+        self.prev_columns = columns
+
+def column_order(id_fields, keys):
+    """Returns the keys with the identifiers first, followed by the rest
+    of them in alphabetical order."""
+    retval = [k for k in id_fields if k in keys]
+    retval.extend(sorted(k for k in keys if k not in id_fields))
+    return retval
+
+class MissingType(object):
+    """The type of the placeholder for the columns a row lacks when the
+    columns of a data set are normalized."""
+
+    def __repr__(self):
+        return 'missing'
+
+missing = MissingType()
+
+class RowShape(object):
+    """The column layout shared by the data of the same schema that have
+    the same set of fields.  The fields that are not rendered (such as the
+    collections of one_to_many) are found out from the first datum and
+    expected to be so for the rest."""
+
+    def __init__(self, table, id_fields, fields):
+        self.table = table
+        self.id_fields = id_fields
+        self.plan = []
+        columns = []
+        for k in column_order(id_fields, fields.keys()):
+            v = fields[k]
+            rendered = not isinstance(v, DynamicField) or v.rendered
+            self.plan.append((k, rendered))
+            if rendered:
+                columns.append(k)
+        self.columns = tuple(columns)
+
+    def _extract_slow(self, fields):
+        columns = []
+        values = []
+        for k, _ in self.plan:
+            v = fields[k]
+            if isinstance(v, DynamicField):
+                if not v.rendered:
+                    continue
+                v = v.render()
+            columns.append(k)
+            values.append(v)
+        return tuple(columns), values
+
+    def extract(self, fields):
+        """Returns the columns and the values to be rendered for them."""
+        values = []
+        for k, rendered in self.plan:
+            v = fields[k]
+            if isinstance(v, DynamicField):
+                if not v.rendered:
+                    if rendered:
+                        return self._extract_slow(fields)
+                    continue
+                v = v.render()
+            elif not rendered:
+                return self._extract_slow(fields)
+            values.append(v)
+        return self.columns, values
+
+def shape_of(shapes, datum):
+    """Looks up the shape of the datum in the cache, creating it if it is
+    not there yet."""
+    fields = datum._tableau_fields
+    key = (datum._tableau_schema, datum._tableau_id_fields, tuple(fields))
+    shape = shapes.get(key)
+    if shape is None:
+        shape = shapes[key] = RowShape(datum._tableau_schema, datum._tableau_id_fields, fields)
+    return shape
+
+def normalize_rows(rows, id_fields):
+    """Rewrites the rows so that all of them have the union of their
+    columns, filling the columns a row lacks with `missing`."""
+    distinct_columns = {}
+    for table, columns, values in rows:
+        distinct_columns[id(columns)] = columns
+    all_columns = set()
+    for columns in distinct_columns.itervalues():
+        all_columns.update(columns)
+    all_columns = tuple(column_order(id_fields, all_columns))
+    positions = {}
+    for columns in distinct_columns.itervalues():
+        if columns != all_columns:
+            indices = dict((k, i) for i, k in enumerate(columns))
+            positions[id(columns)] = [indices.get(k) for k in all_columns]
+    if not positions:
+        return rows
+    retval = []
+    for table, columns, values in rows:
+        _positions = positions.get(id(columns))
+        if _positions is not None:
+            values = [missing if i is None else values[i] for i in _positions]
+        retval.append((table, all_columns, values))
+    return retval
+
+def _extract_rows(shapes, data):
+    for datum in data:
+        shape = shape_of(shapes, datum)
+        columns, values = shape.extract(datum._tableau_fields)
+        yield shape.table, columns, values
+
+def extract_rows(shapes, data, normalize_columns=False):
+    """Turns the data into (table, columns, values) triples, where the
+    values are not rendered yet."""
+    if not normalize_columns:
+        return _extract_rows(shapes, data)
+    data = list(data)
+    if not data:
+        return []
+    return normalize_rows(list(_extract_rows(shapes, data)), data[0]._tableau_id_fields)
 
 class SQLBuilder(object):
-    def __init__(self, out, encoding=None):
+    scalar_types = [
+        (str, 'put_str'),
+        (unicode, 'put_unicode'),
+        (datetime.datetime, 'put_datetime'),
+        (datetime.date, 'put_date'),
+        (datetime.time, 'put_time'),
+        ((float, int, long), 'put_number'),
+        (type(None), 'put_null'),
+        (MissingType, 'put_missing'),
+        ]
+
+    supports_default = True
+    insert_stmt_builder = InsertStmtBuilder
+    observer = None
+
+    def __init__(self, out, encoding=None, max_statement_size=131072, use_default=False):
+        if use_default and not self.supports_default:
+            raise ValueError("%s doesn't support DEFAULT values" % self.__class__.__name__)
         self.out = out
         self.encoding = encoding or self.out.encoding
+        self.max_statement_size = max_statement_size
+        self.use_default = use_default
         self.last_stmt = None
+        self.scalar_renderers = {}
+        self.shapes = {}
+        self.column_clauses = {}
 
     def __del__(self):
         self.flush()
@@ -75,58 +237,347 @@ class SQLBuilder(object):
         else:
             raise TypeError("Unsupported type: " + type(name).__name__)
 
-    def put_scalar(self, scalar):
-        if isinstance(scalar, str):
-            return "'%s'" % scalar.replace("'", "''")
-        elif isinstance(scalar, unicode):
-            return "'%s'" % scalar.replace(u"'", u"''").encode(self.encoding)
-        elif isinstance(scalar, datetime.datetime):
-            return "'%s'" % scalar.strftime("%Y-%m-%d %H:%M:%S")
-        elif isinstance(scalar, datetime.date):
-            return "'%s'" % scalar.strftime("%Y-%m-%d")
-        elif isinstance(scalar, datetime.time):
-            return "'%s'" % scalar.strftime("%H:%M:%S")
-        elif isinstance(scalar, (float, int, long)):
-            return '%d' % scalar
-        elif scalar is None:
-            return 'NULL'
+    def put_column_clause(self, columns):
+        retval = self.column_clauses.get(columns)
+        if retval is None:
+            retval = self.column_clauses[columns] = ', '.join(self.put_identifier(k) for k in columns)
+        return retval
+
+    def put_str(self, scalar):
+        return "'%s'" % scalar.replace("'", "''")
+
+    def put_unicode(self, scalar):
+        return "'%s'" % scalar.replace(u"'", u"''").encode(self.encoding)
+
+    def put_datetime(self, scalar):
+        return "'%s'" % scalar.strftime("%Y-%m-%d %H:%M:%S")
+
+    def put_date(self, scalar):
+        return "'%s'" % scalar.strftime("%Y-%m-%d")
+
+    def put_time(self, scalar):
+        return "'%s'" % scalar.strftime("%H:%M:%S")
+
+    def put_number(self, scalar):
+        return '%d' % scalar
+
+    def put_null(self, scalar):
+        return 'NULL'
+
+    def put_missing(self, scalar):
+        if self.use_default:
+            return 'DEFAULT'
         else:
-            raise TypeError("Unsupported type: " + type(scalar).__name__)
+            return 'NULL'
+
+    def get_scalar_renderer(self, type_):
+        renderer = self.scalar_renderers.get(type_)
+        if renderer is None:
+            for types, name in self.scalar_types:
+                if issubclass(type_, types):
+                    renderer = self.scalar_renderers[type_] = getattr(self, name)
+                    break
+            else:
+                raise TypeError("Unsupported type: " + type_.__name__)
+        return renderer
+
+    def put_scalar(self, scalar):
+        renderer = self.scalar_renderers.get(type(scalar))
+        if renderer is None:
+            renderer = self.get_scalar_renderer(type(scalar))
+        return renderer(scalar)
+
+    def shape_of(self, datum):
+        return shape_of(self.shapes, datum)
 
     def insert(self, table, values):
-        if not isinstance(self.last_stmt, InsertStmtBuilder):
+        if not isinstance(self.last_stmt, self.insert_stmt_builder):
             if self.last_stmt is not None:
                 self.last_stmt.flush()
-            self.last_stmt = InsertStmtBuilder(self)
+            self.last_stmt = self.insert_stmt_builder(self)
         self.last_stmt(table, values)
 
+    def insert_row(self, table, columns, values):
+        if not isinstance(self.last_stmt, self.insert_stmt_builder):
+            if self.last_stmt is not None:
+                self.last_stmt.flush()
+            self.last_stmt = self.insert_stmt_builder(self)
+        self.last_stmt.put_row(table, columns, values)
+
+    def insert_rendered_row(self, table, columns, row):
+        """Writes a row laid out by the render_row() of the statement
+        builder."""
+        if not isinstance(self.last_stmt, self.insert_stmt_builder):
+            if self.last_stmt is not None:
+                self.last_stmt.flush()
+            self.last_stmt = self.insert_stmt_builder(self)
+        self.last_stmt.put_rendered_row(table, columns, row)
+
     def flush(self):
         if self.last_stmt is not None:
             self.last_stmt.flush()
         self.last_stmt = None
          
+class CopyStmtBuilder(InsertStmtBuilder):
+    def flush(self):
+        if self.prev_table is not None:
+            self.write("\\.\n")
+            if self.builder.observer is not None:
+                self.builder.observer.statement_flushed(self.prev_table, self.nbytes_sent)
+        self.prev_table = None
+        self.prev_columns = None
+        self.nbytes_sent = 0
+
+    def render_row(self, values):
+        return "\t".join(values) + "\n"
+
+    def put_rendered_row(self, table, columns, row):
+        if self.prev_table != table or (self.prev_columns is not columns and self.prev_columns != columns):
+            self.flush()
+            self.write("COPY %s (%s) FROM STDIN;\n" % (
+                self.builder.put_identifier(table),
+                self.builder.put_column_clause(columns)))
+        self.write(row)
+        self.prev_table = table
+        self.prev_columns = columns
+
+    def put_row(self, table, columns, values):
+        self.put_rendered_row(table, columns, self.render_row(values))
+
+class TextDataBuilder(SQLBuilder):
+    """The base of the builders that write the values out as tab-separated
+    text rather than SQL literals.  The characters matching escape_pattern
+    are replaced according to escape_table, and NULL is written as \\N."""
+
+    supports_default = False
+    escape_pattern = None
+    escape_table = None
+
+    def _escape(self, scalar):
+        escape_table = self.escape_table
+        return self.escape_pattern.sub(lambda m: escape_table[m.group(0)], scalar)
+
+    def put_str(self, scalar):
+        return self._escape(scalar)
+
+    def put_unicode(self, scalar):
+        return self._escape(scalar).encode(self.encoding)
+
+    def put_datetime(self, scalar):
+        return scalar.strftime("%Y-%m-%d %H:%M:%S")
+
+    def put_date(self, scalar):
+        return scalar.strftime("%Y-%m-%d")
+
+    def put_time(self, scalar):
+        return scalar.strftime("%H:%M:%S")
+
+    def put_null(self, scalar):
+        return '\\N'
+
+    def put_missing(self, scalar):
+        return '\\N'
+
+class PostgreSQLCopyBuilder(TextDataBuilder):
+    """Writes every table out as a COPY ... FROM STDIN block in the text
+    format of PostgreSQL."""
+
+    insert_stmt_builder = CopyStmtBuilder
+
+    escape_pattern = re.compile('[\\\\\b\f\n\r\t\v]')
+    escape_table = {
+        '\\': '\\\\',
+        '\b': '\\b',
+        '\f': '\\f',
+        '\n': '\\n',
+        '\r': '\\r',
+        '\t': '\\t',
+        '\v': '\\v',
+        }
+
+    def put_identifier(self, name):
+        if isinstance(name, unicode):
+            name = name.encode(self.encoding)
+        elif not isinstance(name, str):
+            raise TypeError("Unsupported type: " + type(name).__name__)
+        return '"%s"' % name.replace('"', '""')
+
+class LoadDataStmtBuilder(InsertStmtBuilder):
+    def __init__(self, builder):
+        InsertStmtBuilder.__init__(self, builder)
+        self.file = None
+
+    def flush(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            if self.builder.observer is not None:
+                self.builder.observer.statement_flushed(self.prev_table, self.nbytes_sent)
+        self.prev_table = None
+        self.prev_columns = None
+        self.nbytes_sent = 0
+
+    def render_row(self, values):
+        return "\t".join(values) + "\n"
+
+    def put_row(self, table, columns, values):
+        self.put_rendered_row(table, columns, self.render_row(values))
+
+    def put_rendered_row(self, table, columns, line):
+        if self.prev_table != table or (self.prev_columns is not columns and self.prev_columns != columns):
+            self.flush()
+            path = self.builder.new_data_file_path(table)
+            self.file = open(path, 'wb')
+            self.write("LOAD DATA %sINFILE %s INTO TABLE %s%s (%s);\n" % (
+                self.builder.local and 'LOCAL ' or '',
+                self.builder.put_path(path),
+                self.builder.put_identifier(table),
+                self.builder.charset and ' CHARACTER SET %s' % self.builder.charset or '',
+                self.builder.put_column_clause(columns)))
+        self.file.write(line)
+        self.nbytes_sent += len(line)
+        self.prev_table = table
+        self.prev_columns = columns
+
+class MySQLLoadDataBuilder(TextDataBuilder):
+    """Writes every table out as a tab-separated file in the directory
+    and a LOAD DATA INFILE statement that loads it.  The values are
+    escaped for the default FIELDS and LINES options of LOAD DATA."""
+
+    insert_stmt_builder = LoadDataStmtBuilder
+
+    escape_pattern = re.compile('[\\\\\0\b\n\r\t\x1a]')
+    escape_table = {
+        '\\': '\\\\',
+        '\0': '\\0',
+        '\b': '\\b',
+        '\n': '\\n',
+        '\r': '\\r',
+        '\t': '\\t',
+        '\x1a': '\\Z',
+        }
+
+    def __init__(self, out, encoding=None, directory=None, local=False, charset=None, **kwargs):
+        SQLBuilder.__init__(self, out, encoding, **kwargs)
+        self.directory = directory
+        self.local = local
+        self.charset = charset
+        self.data_file_counts = {}
+
+    def new_data_file_path(self, table):
+        if self.directory is None:
+            raise ValueError("directory is not specified")
+        count = self.data_file_counts.get(table, 0)
+        self.data_file_counts[table] = count + 1
+        if count == 0:
+            filename = '%s.tsv' % table
+        else:
+            filename = '%s.%d.tsv' % (table, count)
+        if isinstance(filename, unicode):
+            filename = filename.encode(self.encoding)
+        return os.path.abspath(os.path.join(self.directory, filename))
+
+    def put_path(self, path):
+        return "'%s'" % path.replace("\\", "\\\\").replace("'", "\\'")
+
+def _render_rows(args):
+    builder_impl, kwargs, rows = args
+    builder = builder_impl(None, **kwargs)
+    render_row = builder.insert_stmt_builder(builder).render_row
+    renderers = builder.scalar_renderers
+    put_scalar = builder.put_scalar
+    return [(table, columns, render_row([renderers.get(type(v), put_scalar)(v) for v in values])) for table, columns, values in rows]
+
 class SQLGenerator(object):
+    """Writes the data in the suite out as SQL statements.
+
+    If a pool (such as a multiprocessing.Pool, or a ThreadPool from
+    multiprocessing.dummy) is given, every chunk of up to chunk_size rows
+    of a data set gets rendered into the text of the rows in the pool,
+    leaving only the splitting of the statements to this process, which
+    still lays them out in the dependency order of the suite, so the
+    output is identical to the one produced without the pool.
+
+    If normalize_columns is true, every row of a data set is written with
+    the union of the columns found in the data set, filling the columns a
+    row lacks with NULL (or DEFAULT if the builder is given use_default),
+    so that a table goes out as a few large statements.
+
+    observer, if given, is told of every statement written and of the
+    time spent emitting (see tableau.instrumentation)."""
+
     logger = logging.getLogger('tableau.SQLGenerator')
 
-    def __init__(self, out, builder_impl=SQLBuilder, **kwargs):
+    def __init__(self, out, builder_impl=SQLBuilder, pool=None, chunk_size=1000, normalize_columns=False, observer=None, **kwargs):
         self.out = out
         self.builder_impl = builder_impl
+        self.pool = pool
+        self.chunk_size = chunk_size
+        self.normalize_columns = normalize_columns
+        self.observer = observer
         self.kwargs = kwargs
 
-    def __call__(self, suite):
+    def _new_builder(self):
         builder = self.builder_impl(self.out, **self.kwargs)
-        for dataset in suite:
-            for data in dataset:
-                values = [] 
-                for k, v in sorted(data._tableau_fields.iteritems(),
-                                   lambda a, b: \
-                                     -1 if a[0] in data._tableau_id_fields \
-                                       else (1 if b[0] in data._tableau_id_fields \
-                                                else cmp(a[0], b[0]))):
-                    if isinstance(v, DynamicField):
-                        if not v.rendered:
-                            continue
-                        v = v.render()
-                    values.append((k, v))
-                builder.insert(data._tableau_schema, values)
+        builder.observer = self.observer
+        return builder
+
+    def _rows(self, builder, data):
+        return extract_rows(builder.shapes, data, self.normalize_columns)
+
+    def _chunks(self, builder, datasets):
+        kwargs = dict(self.kwargs, encoding=builder.encoding)
+        for data in datasets:
+            chunk = []
+            for row in self._rows(builder, data):
+                chunk.append(row)
+                if len(chunk) >= self.chunk_size:
+                    yield self.builder_impl, kwargs, chunk
+                    chunk = []
+            if chunk:
+                yield self.builder_impl, kwargs, chunk
+
+    def _put_data(self, builder, datasets):
+        if self.pool is None:
+            renderers = builder.scalar_renderers
+            put_scalar = builder.put_scalar
+            for data in datasets:
+                for table, columns, values in self._rows(builder, data):
+                    builder.insert_row(table, columns, [renderers.get(type(v), put_scalar)(v) for v in values])
+        else:
+            for rows in self.pool.imap(_render_rows, self._chunks(builder, datasets)):
+                for table, columns, row in rows:
+                    builder.insert_rendered_row(table, columns, row)
+
+    def __call__(self, suite, since=None):
+        """Writes out the data in the suite, or only those added after the
+        checkpoint if since is given."""
+        if self.observer is not None:
+            start = default_timer()
+        builder = self._new_builder()
+        if since is not None:
+            self._put_data(builder, suite.since(since))
+        else:
+            self._put_data(builder, suite)
+        builder.flush()
+        if self.observer is not None:
+            self.observer.phase_completed('emit', default_timer() - start)
+
+    def stream(self, roots, suite=None):
+        """Walks the roots one at a time and writes out the data reached
+        from each root as soon as its walk is complete, in the dependency
+        order of the suite.  The written data are drained from the suite,
+        so only the data of a single root are held at once."""
+        if suite is None:
+            suite = DataSuite(observer=self.observer)
+        walker = DataWalker(suite, self.observer)
+        builder = self._new_builder()
+        for root in roots:
+            walker(root)
+            if self.observer is not None:
+                start = default_timer()
+            self._put_data(builder, [dataset.drain() for dataset in suite if len(dataset)])
+            if self.observer is not None:
+                self.observer.phase_completed('emit', default_timer() - start)
         builder.flush()
+        return suite
@@ -2,19 +2,115 @@ from sqlalchemy.schema import Table
 from tableau.containers import DatumBase
 from tableau.declarations import DynamicField, Lazy, one_to_many, many_to_one, many_to_many, auto
 from tableau.utils import string_container_from_value, is_iterable_container, is_callable
-from sqlalchemy.orm import mapper, relationship
+from tableau.allocators import SequentialAllocator
+from tableau.sql import shape_of
+from sqlalchemy.orm import mapper, relationship, configure_mappers
 from sqlalchemy.orm.mapper import Mapper
+from sqlalchemy.orm.exc import UnmappedColumnError
 from sqlalchemy.orm.properties import RelationshipProperty
 from sqlalchemy.orm.attributes import InstrumentedAttribute, manager_of_class
 from sqlalchemy.orm.instrumentation import unregister_class, instrumentation_registry
 from types import FunctionType
 from warnings import warn
 from weakref import WeakKeyDictionary
+from decimal import Decimal
+import datetime
+
+# the types of the values that are stored as they are
+_plain_types = frozenset([
+    int, long, float, bool, str, unicode, type(None), Decimal,
+    datetime.datetime, datetime.date, datetime.time, datetime.timedelta,
+    ])
+
+class SADatumTemplate(object):
+    """What SADatum derives from the table and the mapper of a class,
+    computed once: the default values of the columns, the identifiers
+    and the names of the declared columns and mapper properties."""
+
+    def __init__(self, table, mapper, defaults):
+        self.table = table
+        self.mapper = mapper
+        self.defaults = defaults
+        self.primary_key_columns = tuple(table.primary_key.columns.keys())
+        if len(self.primary_key_columns) == 1 and \
+                table.primary_key.columns[self.primary_key_columns[0]].autoincrement:
+            self.default_id_fields = auto(self.primary_key_columns[0])
+        else:
+            self.default_id_fields = self.primary_key_columns
+        self.declared = set(table.columns.keys())
+        if mapper is not None:
+            self.declared.update(prop.key for prop in mapper.iterate_properties)
+        self.id_fields_cache = {}
+
+    def id_fields_for(self, id_fields):
+        """Validates the identifiers against the primary key, returning
+        them as a tuple, or the default ones if None."""
+        if id_fields is None:
+            return self.default_id_fields
+        if isinstance(id_fields, basestring):
+            id_fields = (id_fields, )
+        elif not isinstance(id_fields, tuple):
+            id_fields = tuple(id_fields)
+        key = (type(id_fields), id_fields)
+        retval = self.id_fields_cache.get(key)
+        if retval is None:
+            if tuple(id_fields) != self.primary_key_columns:
+                raise ValueError('id_fields does not match to the table definition ([%s] != [%s])' % (','.join(id_fields), ','.join(self.primary_key_columns)))
+            retval = self.id_fields_cache[key] = id_fields
+        return retval
+
+    def is_declared(self, k):
+        # without a mapper, a relation may be held by any field
+        return self.mapper is None or k in self.declared or self.mapper.has_property(k)
+
+class SAField(object):
+    """Reads a field of a SADatum of a table that has no mapped class."""
+
+    __slots__ = ('name', )
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, datum, owner=None):
+        if datum is None:
+            return self
+        try:
+            return datum._tableau_fields[self.name]
+        except KeyError:
+            raise AttributeError('%s.%s' % (datum._tableau_schema, self.name))
+
+# not weak, as every SADatum class refers to its metadata
+_shared_factories = {}
+
+def sharedSADatum(metadata):
+    """Returns the SADatum class for the metadata, which is made by
+    newSADatum() and prepared on the first call and shared by the
+    subsequent calls.  Call reset() on it between tests instead of
+    cleanup(); the latter discards the class so that the next call
+    makes another one.  The class, along with the metadata and the
+    mappers cloned for it, is kept until cleanup() is called."""
+    retval = _shared_factories.get(metadata)
+    if retval is None:
+        retval = _shared_factories[metadata] = newSADatum(metadata).prepare()
+    return retval
 
 def newSADatum(metadata):
     table_to_managed_class = WeakKeyDictionary()
-    for class_, manager_getter in instrumentation_registry._manager_finders.iteritems():
-        table_to_managed_class.setdefault(manager_getter(class_).mapper.local_table, []).append(class_)
+    scanned_classes = set()
+
+    def scan_managed_classes():
+        # the classes of the other SADatum factories are left out
+        finders = instrumentation_registry._manager_finders
+        if len(finders) == len(scanned_classes) and all(class_ in scanned_classes for class_ in finders):
+            return
+        table_to_managed_class.clear()
+        scanned_classes.clear()
+        for class_, manager_getter in finders.items():
+            scanned_classes.add(class_)
+            if not issubclass(class_, DatumBase):
+                table_to_managed_class.setdefault(manager_getter(class_).mapper.local_table, []).append(class_)
+
+    scan_managed_classes()
 
     def default_value(column_def):
         if column_def.default is None:
@@ -25,14 +121,33 @@ def newSADatum(metadata):
         return column_def.default.arg
 
     mixin_class_registry = WeakKeyDictionary()
+    table_class_registry = WeakKeyDictionary()
+    resolved_schemas = {}
 
-    def clone_mapper(mapper_, class_):
+    def template_of(class_, table):
+        template = class_.__dict__.get('_tableau_template')
+        if template is None:
+            template = SADatumTemplate(
+                table,
+                class_.__dict__.get('__mapper__'),
+                dict((k, default_value(table.columns[k])) for k in table.columns.keys()))
+            type.__setattr__(class_, '_tableau_template', template)
+        return template
+
+    def lookup_table_class(table):
+        retval = table_class_registry.get(table)
+        if retval is None:
+            dict_ = dict((k, SAField(k)) for k in table.columns.keys() if not hasattr(SADatum, k))
+            retval = table_class_registry[table] = type("SADatum#%s" % table.name, (SADatum, ), dict_)
+        return retval
+
+    def clone_mapper(mapper_, class_, configure):
         def clone_property(prop):
             if isinstance(prop, RelationshipProperty):
                 if is_callable(prop.argument):
                     argument_ = lambda: lookup_mixin_class(prop.argument())
                 else:
-                    argument_ = lookup_mixin_class(prop.argument)
+                    argument_ = lookup_mixin_class(prop.argument, configure)
                 return relationship(
                     argument_,
                     secondary=prop.secondary,
@@ -73,7 +188,7 @@ def newSADatum(metadata):
             properties=dict((prop.key, clone_property(prop)) for prop in mapper_.iterate_properties),
             primary_key=mapper_.primary_key,
             non_primary=False,
-            inherits=(mapper_.inherits and lookup_mixin_class(mapper_.inherits.class_)),
+            inherits=(mapper_.inherits and lookup_mixin_class(mapper_.inherits.class_, configure)),
             inherit_condition=mapper_.inherit_condition,
             inherit_foreign_keys=mapper_.inherit_foreign_keys,
             order_by=mapper_.order_by,
@@ -93,7 +208,7 @@ def newSADatum(metadata):
             eager_defaults=mapper_.eager_defaults
             )
 
-    def lookup_mixin_class(managed_class):
+    def lookup_mixin_class(managed_class, configure=True):
         class_name = "SADatum#%s" % managed_class.__name__
         retval = mixin_class_registry.get(managed_class)
         if retval is None:
@@ -102,14 +217,29 @@ def newSADatum(metadata):
                          if not isinstance(pair[1], InstrumentedAttribute) and pair[0] != '__init__' and not pair[0].startswith('_sa_'))
             dict_['_tableau_managed_class'] = managed_class
             if mapper.inherits:
-                super_ = lookup_mixin_class(mapper.inherits.class_)
+                super_ = lookup_mixin_class(mapper.inherits.class_, configure)
             else:
                 super_ = SADatum
+            if configure:
+                # configuring the pending mappers may resolve a relationship
+                # to this very class, which must not be cloned twice
+                configure_mappers()
+                retval = mixin_class_registry.get(managed_class)
+                if retval is not None:
+                    return retval
             retval = type(class_name, (super_, ), dict_)
-            retval.__mapper__ = clone_mapper(mapper, retval)
+            retval.__mapper__ = clone_mapper(mapper, retval, configure)
             mixin_class_registry[managed_class] = retval
         return retval
 
+    def dispose_mixin_class(class_):
+        # a mapper cloned while the mappers were being configured is left
+        # unconfigured, and would break the configuration of any mapper
+        # made afterwards unless disposed of
+        class_.__mapper__.dispose()
+        if manager_of_class(class_) is not None:
+            unregister_class(class_)
+
     def managed_class_of_table(table):
         classes = table_to_managed_class.get(table)
         if classes is None:
@@ -125,10 +255,69 @@ def newSADatum(metadata):
         @staticmethod
         def cleanup():
             for managed_class, sadatum_class in mixin_class_registry.items():
-                unregister_class(sadatum_class)
+                dispose_mixin_class(sadatum_class)
+            mixin_class_registry.clear()
+            resolved_schemas.clear()
+            if _shared_factories.get(metadata) is SADatum:
+                del _shared_factories[metadata]
+
+        @staticmethod
+        def prepare():
+            """Builds the classes and the mappers for all the mapped classes
+            of the tables in the metadata at once, instead of doing so the
+            first time each of them is used.  Returns the SADatum class."""
+            # every class is cloned before any mapper is configured, so that
+            # the relationships resolve to the classes already cloned
+            for table in metadata.sorted_tables:
+                for managed_class in table_to_managed_class.get(table, ()):
+                    lookup_mixin_class(managed_class, False)
+            configure_mappers()
+            unconfigured = [class_.__name__ for class_ in mixin_class_registry.itervalues() if not class_.__mapper__.configured]
+            if unconfigured:
+                raise TypeError("mappers of %s were cloned while the mappers were being configured" % ", ".join(sorted(unconfigured)))
+            return SADatum
+
+        @staticmethod
+        def reset():
+            """Catches up with the classes mapped or unmapped since the last
+            time, keeping the classes already built for the others."""
+            resolved_schemas.clear()
+            scan_managed_classes()
+            for managed_class, sadatum_class in mixin_class_registry.items():
+                if managed_class not in scanned_classes:
+                    dispose_mixin_class(sadatum_class)
+                    del mixin_class_registry[managed_class]
+
+        @staticmethod
+        def mixin_class_of(managed_class):
+            return lookup_mixin_class(managed_class)
+
+        @staticmethod
+        def allocators():
+            """Returns the allocators to be passed to DataSuite, which make
+            the tables of the same inheritance hierarchy share the sequence
+            of auto identifiers of its base table."""
+            retval = {}
+            base_allocators = {}
+            for table in metadata.sorted_tables:
+                classes = table_to_managed_class.get(table)
+                if classes:
+                    base_table = manager_of_class(classes[0]).mapper.base_mapper.local_table
+                else:
+                    base_table = table
+                allocator = base_allocators.get(base_table)
+                if allocator is None:
+                    allocator = base_allocators[base_table] = SequentialAllocator()
+                retval[table.name] = allocator
+            return retval
 
         def __new__(cls, schema, id_fields=None, **fields):
             if isinstance(schema, basestring):
+                resolved = resolved_schemas.get(schema)
+                if resolved is not None:
+                    newinstance = object.__new__(resolved[0])
+                    newinstance._tableau_table = resolved[1]
+                    return newinstance
                 table = metadata.tables.get(schema, None)
                 if table is None:
                     raise ValueError("%s is not defined in the metadata" % schema)
@@ -151,48 +340,28 @@ def newSADatum(metadata):
                 assert not issubclass(managed_class, DatumBase)
                 _cls = lookup_mixin_class(managed_class)
             else:
-                _cls = cls
+                _cls = lookup_table_class(table)
+            if isinstance(schema, basestring):
+                resolved_schemas[schema] = (_cls, table)
             newinstance = object.__new__(_cls)
             newinstance._tableau_table = table
             return newinstance
 
         def __init__(self, schema, id_fields=None, **fields):
-            columns = self._tableau_table.columns
-
-            _fields = dict((k, default_value(columns[k])) for k in columns.keys())
-            _fields.update(fields)
-            primary_key_columns = self._tableau_table.primary_key.columns.keys()
-            if id_fields is not None:
-                if isinstance(id_fields, basestring):
-                    id_fields = (id_fields, )
-                elif isinstance(id_fields, tuple):
-                    id_fields = id_fields
-                else:
-                    id_fields = tuple(id_fields)
-                if len(primary_key_columns) != len(id_fields):
-                    id_fields_matched = False
-                else:
-                    id_fields_matched = True
-                    for k1, k2 in zip(primary_key_columns, id_fields):
-                        if k1 != k2:
-                            id_fields_matched = False
-                            break
-                if not id_fields_matched:
-                    raise ValueError('id_fields does not match to the table definition ([%s] != [%s])' % (','.join(id_fields), ','.join(primary_key_columns)))
-            else:
-                if len(primary_key_columns) == 1 and \
-                    self._tableau_table.primary_key.columns[primary_key_columns[0]].autoincrement:
-                    id_fields = auto(primary_key_columns[0])
-                else:
-                    id_fields = tuple(primary_key_columns)
-            self._tableau_schema = self._tableau_table.name
-            self._tableau_id_fields = id_fields
+            table = self._tableau_table
+            template = template_of(self.__class__, table)
+            self._tableau_schema = table.name
+            self._tableau_id_fields = template.id_fields_for(id_fields)
             self._tableau_fields = {}
+            _fields = template.defaults
+            if fields:
+                _fields = dict(_fields)
+                _fields.update(fields)
             for k, v in _fields.iteritems():
                 setattr(self, k, v)
 
         def __check_key_is_declared(self, k):
-            if k not in self._tableau_table.columns and hasattr(self, '__mapper__') and not self.__mapper__.has_property(k):
+            if not template_of(self.__class__, self._tableau_table).is_declared(k):
                 raise KeyError("%s is not declared in the table definition or mapper configuration" % k)
 
         def _value_of(self, k, value):
@@ -207,17 +376,22 @@ def newSADatum(metadata):
             else:
                 return value
 
-        def __getattribute__(self, k):
-            if k.startswith('_') or hasattr(self.__class__, k):
-                return object.__getattribute__(self, k)
+        def __getattr__(self, k):
+            # the fields that are neither columns nor mapper properties
+            if k.startswith('_'):
+                raise AttributeError(k)
             try:
-                return object.__getattribute__(self, '_tableau_fields')[k]
+                return self._tableau_fields[k]
             except KeyError:
                 raise AttributeError('%s.%s' % (self._tableau_schema, k))
-                
+
         def __setattr__(self, k, v):
             if k.startswith('_'):
                 object.__setattr__(self, k, v)
+            elif type(v) in _plain_types:
+                self._tableau_fields[k] = v
+                if self._tableau_managed_class is not None:
+                    object.__setattr__(self, k, v)
             else:
                 if isinstance(v, FunctionType):
                     v = Lazy(v)
@@ -238,7 +412,7 @@ def newSADatum(metadata):
                     if v.referred_fields is not None:
                         for _k in v.referred_fields:
                             self.__check_key_is_declared(_k)
-                object.__getattribute__(self, '_tableau_fields')[k] = v
+                self._tableau_fields[k] = v
                 if self._tableau_managed_class is not None and not isinstance(v, Lazy):
                     object.__setattr__(self, k, self._value_of(k, v))
 
@@ -248,3 +422,118 @@ def newSADatum(metadata):
                     object.__setattr__(self, k, self._value_of(k, v))
 
     return SADatum
+
+class SABulkLoader(object):
+    """Inserts the SADatums in the suite with Core insert() statements,
+    executing one executemany() for every batch of up to batch_size rows
+    of the same table and columns, in the dependency order of the suite
+    and in a single transaction.  The data of a mapped subclass go into
+    every table of its inheritance hierarchy, with the discriminator set
+    to its polymorphic identity.  Nothing goes through the Session.
+
+    Walk the suite with the allocators given by SADatum.allocators() when
+    there are mapped subclasses, so that the identifiers don't collide in
+    the shared tables.  The tables of the data other than SADatums, such
+    as the intermediate data of many_to_many(..., via=...), are looked up
+    in the metadata."""
+
+    def __init__(self, connectable, batch_size=1000, metadata=None):
+        self.connectable = connectable
+        self.batch_size = batch_size
+        self.metadata = metadata
+        self.shapes = {}
+        self.plans = {}
+
+    def table_of(self, datum):
+        table = getattr(datum, '_tableau_table', None)
+        if table is None:
+            if self.metadata is None:
+                raise ValueError("metadata is required to load %s data that are not SADatums" % datum._tableau_schema)
+            table = self.metadata.tables.get(datum._tableau_schema)
+            if table is None:
+                raise ValueError("%s is not defined in the metadata" % datum._tableau_schema)
+        return table
+
+    def plan_for(self, datum, columns):
+        """Returns a list of (table, [(column key, field, constant)]) to
+        insert the datum with the given rendered fields; field is None if
+        the column gets the constant."""
+        key = (datum.__class__, datum._tableau_schema, columns)
+        retval = self.plans.get(key)
+        if retval is not None:
+            return retval
+        fields = set(columns)
+        retval = []
+        mapper = getattr(datum, '_tableau_managed_class', None) is not None and datum.__mapper__ or None
+        if mapper is None:
+            tables = [self.table_of(datum)]
+        else:
+            tables = []
+            for _mapper in reversed(list(mapper.iterate_to_root())):
+                if _mapper.local_table not in tables:
+                    tables.append(_mapper.local_table)
+        for table in tables:
+            plan = []
+            for column in table.columns:
+                field = column.key
+                if mapper is not None:
+                    try:
+                        field = mapper.get_property_by_column(column).key
+                    except UnmappedColumnError:
+                        pass
+                if field in fields:
+                    plan.append((column.key, field, None))
+                elif mapper is not None and mapper.polymorphic_on is not None and \
+                        mapper.polymorphic_identity is not None and \
+                        column in mapper.polymorphic_on.proxy_set:
+                    plan.append((column.key, None, mapper.polymorphic_identity))
+            retval.append((table, plan))
+        self.plans[key] = retval
+        return retval
+
+    def rows(self, dataset):
+        """Returns the rows of the data set grouped by table and columns.
+        The tables are ordered by their first appearance, so the tables of
+        the base classes come first."""
+        groups = {}
+        tables = []
+        groups_by_table = {}
+        for datum in dataset:
+            shape = shape_of(self.shapes, datum)
+            columns, values = shape.extract(datum._tableau_fields)
+            values = dict(zip(columns, values))
+            for table, plan in self.plan_for(datum, columns):
+                row = {}
+                for column_key, field, constant in plan:
+                    if field is None:
+                        row[column_key] = constant
+                    else:
+                        row[column_key] = values[field]
+                group_key = (table, tuple(sorted(row)))
+                rows = groups.get(group_key)
+                if rows is None:
+                    rows = groups[group_key] = []
+                    table_groups = groups_by_table.get(table)
+                    if table_groups is None:
+                        table_groups = groups_by_table[table] = []
+                        tables.append(table)
+                    table_groups.append(rows)
+                rows.append(row)
+        return [(table, rows) for table in tables for rows in groups_by_table[table]]
+
+    def __call__(self, suite):
+        connection = self.connectable.connect()
+        try:
+            transaction = connection.begin()
+            try:
+                for dataset in suite:
+                    for table, rows in self.rows(dataset):
+                        statement = table.insert()
+                        for i in xrange(0, len(rows), self.batch_size):
+                            connection.execute(statement, rows[i:i + self.batch_size])
+                transaction.commit()
+            except:
+                transaction.rollback()
+                raise
+        finally:
+            connection.close()
@@ -0,0 +1,314 @@
+# encoding: utf-8
+
+"""Keeps the data sets of a suite on disk rather than in memory.
+
+A suite given a SQLiteStore renders the data that the walker is done
+with into a SQLite database once its data sets hold spill_threshold of
+them in total, and forgets about them except for weak references, so a
+datum that is still alive is never added twice.  The data sets are
+spilled all at once because a datum left in memory would keep the data
+it refers to alive.  Iterating over a data set
+(which is what SQLGenerator and the loaders do) reads the rows back
+ordered by their identifiers, through the index on the identifiers::
+
+    store = SQLiteStore()
+    suite = DataSuite(store=store)
+    walker = DataWalker(suite)
+    for root in roots:
+        walker(root)
+    SQLGenerator(out)(suite)
+    store.close()
+
+Just like the data in a suite loaded from a snapshot (see
+tableau.snapshot), the data read back are plain Datum objects carrying
+the rendered values of the original ones, so Lazy fields are evaluated
+when their datum is spilled rather than when it is written out.  The
+identifiers must be of the types that sqlite3 can bind, and the data
+of the schemas with natural keys are kept in memory.
+"""
+
+import os
+import tempfile
+import sqlite3
+from weakref import WeakKeyDictionary
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from tableau.containers import Datum
+from tableau.dataset import DataSet, _sort_key
+from tableau.sql import extract_rows
+
+__all__ = [
+    'SQLiteStore',
+    'StagedDataSet',
+    ]
+
+_missing = object()
+
+class StagedDataSet(DataSet):
+    """A data set whose data are moved to the store once they are fixed.
+    data holds only the data not spilled yet."""
+
+    def __init__(self, schema, allocator, observer, store, natural_key=None):
+        DataSet.__init__(self, schema, allocator, observer, natural_key)
+        self.store = store
+        self.table = None
+        self.id_fields = None
+        self.pending = []
+        self.spilling = []
+        self.spilled = WeakKeyDictionary()
+        self.num_spilled = 0
+
+    def __len__(self):
+        return len(self.data) + self.num_spilled
+
+    def __contains__(self, datum):
+        return datum in self.spilled or DataSet.__contains__(self, datum)
+
+    def add(self, datum):
+        if datum in self.spilled:
+            return False
+        if not DataSet.add(self, datum):
+            return False
+        self.pending.append((self.log_base + len(self.log) - 1, datum))
+        self.store.added()
+        return True
+
+    def restore(self, data, seq):
+        if self.natural_key is not None:
+            for datum in data:
+                self.canonical_data.setdefault(self.natural_key_of(datum), datum)
+        for datum in data:
+            self.data.add(datum)
+            self.log.append(datum)
+            self.pending.append((self.log_base + len(self.log) - 1, datum))
+        self.store.num_pending += len(data)
+        self.spill()
+        if seq is not None:
+            self.seq = seq
+
+    def spill(self, fixed_only=False):
+        """Moves the pending data to the store; with fixed_only, those the
+        walker is not done with yet are left in memory."""
+        if fixed_only:
+            spilling = [pair for pair in self.pending if pair[1]._tableau_fixed]
+            if not spilling:
+                return
+            self.pending = [pair for pair in self.pending if not pair[1]._tableau_fixed]
+        else:
+            spilling = self.pending
+            if not spilling:
+                return
+            self.pending = []
+        if self.table is None:
+            self.id_fields = spilling[0][1]._tableau_id_fields
+            self.table = self.store.create_table(len(self.id_fields))
+        # the Lazy fields rendered on the way may look the data up
+        self.spilling = spilling
+        try:
+            self.store.write(self.table, self.rows_of(spilling))
+        finally:
+            self.spilling = []
+        for ordinal, datum in spilling:
+            self.data.discard(datum)
+            self.spilled[datum] = True
+        self.num_spilled += len(spilling)
+        self.store.num_pending -= len(spilling)
+        if self.observer is not None:
+            self.observer.data_drained(self.schema, len(spilling))
+        # the ordinals are already in pending; the log would only keep the
+        # data alive
+        self.log_base += len(self.log)
+        self.log = []
+        self.sorted_data = None
+
+    def rows_of(self, pairs):
+        columns_id_of = self.store.columns_id_of
+        dumps = pickle.dumps
+        rows = extract_rows(self.store.shapes, [pair[1] for pair in pairs])
+        for (ordinal, datum), (table, columns, values) in zip(pairs, rows):
+            yield _sort_key(datum) + (ordinal, columns_id_of(columns), sqlite3.Binary(dumps(values, pickle.HIGHEST_PROTOCOL)))
+
+    def read(self, since=None, id_values=None):
+        """Iterates over the spilled data ordered by their identifiers."""
+        if self.table is None:
+            return iter(())
+        return self.store.read(self.table, self.schema, self.id_fields, since, id_values)
+
+    def _spill_for_reading(self):
+        """Spills the pending data before they are read back, except for
+        those the walker is not done with if a walk is in progress; the
+        data left in memory are returned."""
+        if self.spilling:
+            return [pair[1] for pair in self.spilling + self.pending]
+        if self.suite is not None and self.suite.walking:
+            self.spill(fixed_only=True)
+            return [pair[1] for pair in self.pending]
+        self.spill()
+        return []
+
+    def __iter__(self):
+        unfixed = self._spill_for_reading()
+        if not unfixed:
+            return self.read()
+        retval = list(self.read())
+        retval.extend(unfixed)
+        retval.sort(key=_sort_key)
+        return iter(retval)
+
+    def get(self):
+        return list(self)
+
+    def drain(self):
+        data = self.get()
+        if self.table is not None:
+            self.store.clear(self.table)
+        if self.drained is None:
+            self.drained = WeakKeyDictionary()
+        for datum in self.spilled.keys():
+            self.drained[datum] = True
+        self.spilled = WeakKeyDictionary()
+        self.num_spilled = 0
+        # the observer has been told of the data as they were spilled
+        return data
+
+    def find(self, **criteria):
+        """Looks the data up through the index of the store if the criteria
+        are the identifiers, or by reading every datum otherwise.  The data
+        a walk is still on are matched one by one."""
+        unfixed = self._spill_for_reading()
+        items = criteria.items()
+        if self.id_fields is not None and len(criteria) == len(self.id_fields) and all(k in criteria for k in self.id_fields):
+            retval = list(self.read(id_values=tuple(criteria[k] for k in self.id_fields)))
+        else:
+            retval = [
+                datum for datum in self.read()
+                if all(datum._tableau_fields.get(k, _missing) == v for k, v in items)
+                ]
+        if unfixed:
+            retval.extend(
+                datum for datum in unfixed
+                if all(getattr(datum, k, _missing) == v for k, v in items)
+                )
+            retval.sort(key=_sort_key)
+        return retval
+
+    def lookup(self, *id_values):
+        unfixed = self._spill_for_reading()
+        id_fields = self.id_fields
+        if id_fields is None and unfixed:
+            id_fields = unfixed[0]._tableau_id_fields
+        if id_fields is None:
+            return None
+        if len(id_values) != len(id_fields):
+            raise ValueError("%s is identified by %d field(s) (%d given)" % (self.schema, len(id_fields), len(id_values)))
+        for datum in self.find(**dict(zip(id_fields, id_values))):
+            return datum
+        return None
+
+    def since(self, mark):
+        retval = list(self.read(mark))
+        retval.extend(pair[1] for pair in self.pending if pair[0] >= mark)
+        retval.sort(key=_sort_key)
+        return retval
+
+class SQLiteStore(object):
+    """Stores the spilled data sets in the SQLite database at the path,
+    or in a temporary file removed by close() if no path is given.
+    Every data set gets a table of its own, keyed by the identifiers of
+    the data and the order they were added in."""
+
+    def __init__(self, path=None, spill_threshold=10000):
+        self.temporary = path is None
+        if self.temporary:
+            fd, path = tempfile.mkstemp(prefix='tableau-', suffix='.sqlite')
+            os.close(fd)
+        self.path = path
+        self.spill_threshold = spill_threshold
+        self.connection = sqlite3.connect(path)
+        self.connection.text_factory = str
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.execute('PRAGMA journal_mode = OFF')
+        self.num_tables = 0
+        self.datasets = []
+        self.num_pending = 0
+        self.spill_at = spill_threshold
+        self.key_columns = {}
+        self.columns_ids = {}
+        self.columns_list = []
+        self.shapes = {}
+
+    def new_dataset(self, schema, allocator=None, observer=None, natural_key=None):
+        dataset = StagedDataSet(schema, allocator, observer, self, natural_key)
+        self.datasets.append(dataset)
+        return dataset
+
+    def added(self):
+        self.num_pending += 1
+        if self.num_pending >= self.spill_at:
+            for dataset in self.datasets:
+                dataset.spill(fixed_only=True)
+            # don't rescan the data the walker is still on at every add
+            self.spill_at = self.num_pending + self.spill_threshold
+
+    def columns_id_of(self, columns):
+        retval = self.columns_ids.get(columns)
+        if retval is None:
+            retval = self.columns_ids[columns] = len(self.columns_list)
+            self.columns_list.append(columns)
+        return retval
+
+    def create_table(self, num_keys):
+        table = 'data%d' % self.num_tables
+        self.num_tables += 1
+        keys = tuple('k%d' % i for i in range(0, num_keys))
+        self.key_columns[table] = keys
+        self.connection.execute('CREATE TABLE %s (%s)' % (table, ', '.join(keys + ('ordinal INTEGER', 'columns INTEGER', 'payload BLOB'))))
+        self.connection.execute('CREATE INDEX %s_key ON %s (%s)' % (table, table, ', '.join(keys + ('ordinal', ))))
+        return table
+
+    def write(self, table, rows):
+        """Inserts the rows, each of which is made of the identifiers, the
+        ordinal, the id of the columns and the pickled values."""
+        keys = self.key_columns[table]
+        self.connection.executemany(
+            'INSERT INTO %s VALUES (%s)' % (table, ', '.join('?' * (len(keys) + 3))),
+            rows)
+        self.connection.commit()
+
+    def read(self, table, schema, id_fields, since=None, id_values=None):
+        keys = self.key_columns[table]
+        query = 'SELECT columns, payload FROM %s' % table
+        conditions = []
+        args = []
+        if since is not None:
+            conditions.append('ordinal >= ?')
+            args.append(since)
+        if id_values is not None:
+            conditions.extend('%s = ?' % k for k in keys)
+            args.extend(id_values)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY %s' % ', '.join(keys + ('ordinal', ))
+        columns_list = self.columns_list
+        new = object.__new__
+        loads = pickle.loads
+        for columns_id, payload in self.connection.execute(query, args):
+            datum = new(Datum)
+            datum.__dict__ = {
+                '_tableau_schema': schema,
+                '_tableau_id_fields': id_fields,
+                '_tableau_fields': dict(zip(columns_list[columns_id], loads(str(payload)))),
+                '_tableau_fixed': True,
+                }
+            yield datum
+
+    def clear(self, table):
+        self.connection.execute('DELETE FROM %s' % table)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+        if self.temporary and os.path.exists(self.path):
+            os.remove(self.path)
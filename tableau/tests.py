@@ -1,14 +1,67 @@
-from tableau.dataset import DataSuite, DataWalker
-from tableau.containers import Datum
-from tableau.declarations import one_to_many, many_to_one, auto
+from tableau.dataset import DataSet, DataSuite, DataWalker, ReferenceGraph, CyclicReferenceError
+from tableau.containers import Datum, newDatumClass
+from tableau.builder import Builder, each
+from tableau.declarations import one_to_many, many_to_one, many_to_many, auto, memoized, Lazy
 from tableau.sqla import newSADatum
+from tableau.sql import SQLGenerator, PostgreSQLCopyBuilder, MySQLLoadDataBuilder
+from tableau.dbapi import DBAPILoader
 from unittest import TestCase
+from StringIO import StringIO
 from sqlalchemy.schema import MetaData, Table, Column, ForeignKey
 from sqlalchemy.types import Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.engine import create_engine
 from sqlalchemy.orm import sessionmaker, relationship
 
+_counter = None
+
+def _set_counter(counter):
+    global _counter
+    _counter = counter
+
+def _allocate_with_counter(n):
+    from tableau.allocators import BlockAllocator
+    allocator = BlockAllocator(_counter, 4)
+    return [allocator.allocate(None) for i in range(0, n)]
+
+def _build_tenant(i):
+    country = Datum('Country', auto('id'), code='C%d' % i)
+    tags = [Datum('Tag', auto('id'), name='tag%d-%d' % (i, j)) for j in range(0, 2)]
+    return Datum(
+        'Tenant',
+        auto('id'),
+        name='tenant%d' % i,
+        country=many_to_one(country, 'country_id'),
+        slug=lambda datum: 'tenant-%d' % datum.id,
+        users=one_to_many([
+            Datum(
+                'User',
+                auto('id'),
+                name='user%d-%d' % (i, j),
+                tags=many_to_many(tags, 'user_id', 'tag_id', via='UserTag')
+                )
+            for j in range(0, i % 3 + 1)
+            ], 'tenant_id')
+        )
+
+def _build_foos(num_foos, new_bars, **fields):
+    suite = DataSuite()
+    walker = DataWalker(suite)
+    for i in range(0, num_foos):
+        walker(Datum(
+            'Foo',
+            auto('id'),
+            name=u'foo%d' % i,
+            bars=one_to_many(new_bars(), 'foo_id'),
+            **fields
+            ))
+    return suite
+
+def _generate(suite, since=None, **kwargs):
+    out = StringIO()
+    SQLGenerator(out, encoding='utf-8', **kwargs)(suite, since)
+    return out.getvalue()
+
 class DataSetTest(TestCase):
     def setUp(self):
         self.SADatum = None
@@ -174,6 +227,852 @@ class DataSetTest(TestCase):
         DataWalker(suite)(a)
         self.assertEqual(1, a._tableau_fields['parent'].render())
 
+    def testNaturalKey(self):
+        roots = [_build_tenant(i) for i in (0, 3)]
+        suite = DataSuite(natural_keys={'Country': ('code', ), 'Tag': ('name', )})
+        walker = DataWalker(suite)
+        for root in roots:
+            walker(root)
+        walker(Datum('Tenant', auto('id'), name='tenant', country=many_to_one(Datum('Country', auto('id'), code='C0'), 'country_id')))
+        self.assertEqual(['C0', 'C3'], [datum.code for datum in suite['Country']])
+        self.assertEqual(3, len(suite['Tenant'].data))
+        for tenant in suite['Tenant']:
+            self.assertTrue(tenant.country in suite['Country'].data)
+            self.assertEqual(tenant.country.id, tenant.country_id)
+        self.assertEqual(4, len(suite['Tag'].data))
+        walker(Datum('User', auto('id'), name='user', tags=many_to_many([Datum('Tag', auto('id'), name='tag3-1')], 'user_id', 'tag_id', via='UserTag')))
+        self.assertEqual(4, len(suite['Tag'].data))
+        self.assertEqual([(1, 1), (1, 2), (2, 3), (2, 4), (3, 4)], [(datum.user_id, datum.tag_id) for datum in suite['UserTag']])
+        duplicate = Datum('Tag', auto('id'), name='tag0-1')
+        self.assertFalse(suite['Tag'].add(duplicate))
+        self.assertEqual(2, suite['Tag'].canonical_of(duplicate).id)
+        self.assertTrue(suite['User'].canonical_of(roots[0].users[0]) is roots[0].users[0])
+
+    def testManyToManyViaBothSides(self):
+        member = Datum('Member', auto('id'), name='member')
+        group = Datum('Group', auto('id'), name='group')
+        member.groups = many_to_many([group], 'member_id', 'group_id', via='Membership')
+        group.members = many_to_many([member], 'group_id', 'member_id', via='Membership')
+        suite = DataSuite()
+        DataWalker(suite)(member)
+        self.assertEqual(['Member', 'Group', 'Membership'], [dataset.schema for dataset in suite])
+        sql = _generate(suite)
+        self.assertTrue('INSERT INTO `Membership`' in sql)
+
+    def testManyToManyViaSidesWithDependencies(self):
+        tenant = Datum('Tenant', auto('id'), name='tenant')
+        member = Datum('Member', auto('id'), name='member', tenant=many_to_one(tenant, 'tenant_id'))
+        group = Datum('Group', auto('id'), name='group', tenant=many_to_one(tenant, 'tenant_id'))
+        member.groups = many_to_many([group], 'member_id', 'group_id', via='Membership')
+        suite = DataSuite()
+        DataWalker(suite)(member)
+        self.assertEqual(['Tenant', 'Member', 'Group', 'Membership'], [dataset.schema for dataset in suite])
+
+    def testNaturalKeyWithForeignKey(self):
+        countries = [Datum('Country', auto('id'), code=code) for code in ('JP', 'US', 'JP')]
+        cities = [
+            Datum('City', auto('id'), name=name, country=many_to_one(country, 'country_id'))
+            for country in countries
+            for name in ('Springfield', 'Springfield', 'Portland')
+            ]
+        suite = DataSuite(natural_keys={'Country': ('code', ), 'City': ('country_id', 'name')})
+        walker = DataWalker(suite)
+        for city in cities:
+            walker(Datum('Address', auto('id'), city=many_to_one(city, 'city_id')))
+        self.assertEqual([(1, 'JP'), (2, 'US')], [(datum.id, datum.code) for datum in suite['Country']])
+        self.assertEqual(
+            [(1, 1, 'Springfield'), (2, 1, 'Portland'), (3, 2, 'Springfield'), (4, 2, 'Portland')],
+            [(datum.id, datum.country_id, datum.name) for datum in suite['City']])
+        self.assertEqual([1, 1, 2, 3, 3, 4, 1, 1, 2], [datum.city_id for datum in suite['Address']])
+
+    def testFind(self):
+        suite = DataSuite()
+        walker = DataWalker(suite)
+        for i in range(0, 3):
+            walker(_build_tenant(i))
+        self.assertEqual(['user2-0', 'user2-1', 'user2-2'], [datum.name for datum in suite.find('User', tenant_id=3)])
+        self.assertEqual([], suite.find('User', tenant_id=4))
+        self.assertEqual([], suite.find('Nonexistent', id=1))
+        walker(_build_tenant(3))
+        self.assertEqual(['user3-0'], [datum.name for datum in suite.find('User', tenant_id=4)])
+        self.assertEqual(['user1-1'], [datum.name for datum in suite.find('User', tenant_id=2, name='user1-1')])
+        self.assertEqual(1, len(suite['User'].indexes[('tenant_id', )].entries[(4, )]))
+        self.assertEqual('tenant2', suite.lookup('Tenant', 3).name)
+        self.assertEqual(None, suite.lookup('Tenant', 5))
+        self.assertEqual(None, suite.lookup('Nonexistent', 1))
+        self.assertRaises(ValueError, suite.lookup, 'Tenant', 1, 2)
+        self.assertEqual([(1, 1), (1, 2)], [(datum.user_id, datum.tag_id) for datum in suite.find('UserTag', user_id=1)])
+
+        # the data the walker is not done with are found as well
+        found = []
+        root = Datum('Tenant', auto('id'), name='tenant4', slug=lambda datum: found.extend(suite.find('Tenant', name='tenant4')) or 'tenant-5')
+        walker(root)
+        self.assertEqual([root], found)
+        self.assertEqual([root], suite.find('Tenant', name='tenant4'))
+
+        # as are the data added outside a walker, through the index
+        suite['Tenant'].add(Datum('Tenant', 'id', id=10, name='tenant10'))
+        self.assertEqual(['tenant10'], [datum.name for datum in suite.find('Tenant', id=10)])
+        self.assertEqual([], suite['Tenant'].indexes[('id', )].unfixed)
+        dataset = DataSet('Tenant')
+        dataset.add(Datum('Tenant', 'id', id=1, name='tenant0'))
+        self.assertEqual('tenant0', dataset.lookup(1).name)
+        self.assertEqual([], dataset.indexes[('id', )].unfixed)
+
+    def testDeepManyToOneChain(self):
+        prev = None
+        for i in range(0, 5000):
+            prev = Datum(
+                'Revision',
+                auto('id'),
+                previous=many_to_one(prev, 'previous_id')
+                )
+        suite = DataSuite()
+        DataWalker(suite)(prev)
+        self.assertEqual(5000, len(suite['Revision'].data))
+        self.assertEqual(1, prev.id)
+        self.assertEqual(2, prev.previous_id)
+
+    def testDeepOneToManyChain(self):
+        root = leaf = Datum('Category', auto('id'))
+        for i in range(0, 5000):
+            child = Datum('Category', auto('id'))
+            leaf.children = one_to_many([child], 'parent_id')
+            leaf = child
+        suite = DataSuite()
+        DataWalker(suite)(root)
+        self.assertEqual(5001, len(suite['Category'].data))
+        self.assertEqual(5001, leaf.id)
+        self.assertEqual(5000, leaf.parent_id)
+
+    def testGetOrdersByCompositeKey(self):
+        dataset = DataSet('Schema')
+        for id1, id2 in [(2, 1), (1, 2), (1, 1), (2, 0)]:
+            dataset.add(Datum('Schema', ('id1', 'id2'), id1=id1, id2=id2))
+        self.assertEqual([(1, 1), (1, 2), (2, 0), (2, 1)], [datum._id for datum in dataset])
+        dataset.add(Datum('Schema', ('id1', 'id2'), id1=0, id2=5))
+        self.assertEqual([(0, 5), (1, 1), (1, 2), (2, 0), (2, 1)], [datum._id for datum in dataset.get()])
+
+class AllocatorTest(TestCase):
+    def testStartingOffset(self):
+        from tableau.allocators import SequentialAllocator
+        suite = DataSuite(allocators={'Foo': SequentialAllocator(101)})
+        foo = Datum('Foo', auto('id'))
+        bar = Datum('Bar', auto('id'))
+        DataWalker(suite)(foo)
+        DataWalker(suite)(bar)
+        self.assertEqual(101, foo.id)
+        self.assertEqual(1, bar.id)
+        self.assertEqual(102, suite['Foo'].seq)
+
+    def testBlockAllocator(self):
+        from tableau.allocators import BlockAllocator, LocalCounter
+        counter = LocalCounter(1)
+        suites = [DataSuite(allocators=lambda schema: BlockAllocator(counter, 3)) for i in range(0, 2)]
+        ids = []
+        for i in range(0, 4):
+            for suite in suites:
+                foo = Datum('Foo', auto('id'))
+                DataWalker(suite)(foo)
+                ids.append(foo.id)
+        self.assertEqual([1, 4, 2, 5, 3, 6, 7, 10], ids)
+        self.assertEqual(None, suites[0]['Foo'].seq)
+
+    def testSharedCounter(self):
+        from multiprocessing import Pool
+        from tableau.allocators import SharedCounter
+        pool = Pool(2, _set_counter, (SharedCounter(1), ))
+        try:
+            results = pool.map(_allocate_with_counter, [5, 5, 5])
+        finally:
+            pool.close()
+        ids = sorted(id for result in results for id in result)
+        self.assertEqual(15, len(set(ids)))
+        for result in results:
+            self.assertEqual(sorted(result), result)
+
+    def testContentHashAllocator(self):
+        from tableau.allocators import ContentHashAllocator
+        def walk(*data):
+            suite = DataSuite(allocators=lambda schema: ContentHashAllocator(bits=31))
+            walker = DataWalker(suite)
+            for datum in data:
+                walker(datum)
+        a1 = Datum('Country', auto('id'), code='JP')
+        b1 = Datum('Country', auto('id'), code='US')
+        walk(a1, b1)
+        a2 = Datum('Country', auto('id'), code='JP')
+        walk(a2)
+        self.assertEqual(a1.id, a2.id)
+        self.assertNotEqual(a1.id, b1.id)
+        self.assertTrue(0 < a1.id < 2 ** 31)
+        self.assertRaises(ValueError, walk, Datum('Country', auto('id'), code='JP'), Datum('Country', auto('id'), code='JP'))
+
+class MemoizedTest(TestCase):
+    def testMemoized(self):
+        calls = []
+        def slug(datum):
+            calls.append(datum.name)
+            return '%s-%d' % (datum.name.lower(), datum.id)
+        a = Datum('Schema', auto('id'), id=0, name='Foo', slug=memoized(slug))
+        self.assertEqual('foo-0', a.slug)
+        self.assertEqual('foo-0', a.slug)
+        self.assertEqual(2, len(calls))
+        DataWalker(DataSuite())(a)
+        del calls[:]
+        self.assertEqual('foo-1', a.slug)
+        self.assertEqual('foo-1', a.slug)
+        self.assertEqual(1, len(calls))
+        a.name = 'Bar'
+        self.assertEqual('bar-1', a.slug)
+        self.assertEqual('bar-1', a.slug)
+        self.assertEqual(2, len(calls))
+        a.name = 'Bar'
+        self.assertEqual('bar-1', a.slug)
+        self.assertEqual(2, len(calls))
+
+    def testArgspecIsCached(self):
+        def func(datum):
+            return 1
+        self.assertTrue(Lazy(func).argspec is Lazy(func).argspec)
+
+class BuilderTest(TestCase):
+    def testInheritance(self):
+        class User(Builder):
+            __id_fields__ = auto('id')
+            name = 'user'
+            role = 'member'
+        class Admin(User):
+            __schema__ = 'User'
+            role = 'admin'
+            email = lambda datum: '%s@example.com' % datum.name
+        admin = Admin(name='root')
+        self.assertEqual('User', admin._tableau_schema)
+        self.assertEqual(('id', ), admin._tableau_id_fields)
+        self.assertTrue(isinstance(admin._tableau_id_fields, auto))
+        self.assertEqual('root', admin.name)
+        self.assertEqual('admin', admin.role)
+        self.assertEqual('root@example.com', admin.email)
+        self.assertEqual('member', User().role)
+        self.assertRaises(AttributeError, getattr, User(), 'email')
+        suite = DataSuite()
+        DataWalker(suite)(admin)
+        self.assertEqual(1, admin.id)
+
+    def testBuildMany(self):
+        class Item(Builder):
+            __id_fields__ = auto('id')
+            value = 0
+            label = lambda datum: 'item-%d' % datum.value
+        items = Item.build_many(3, value=each(lambda i: i * 10), kind=each(['a', 'b', 'c']), owner_id=5)
+        self.assertEqual(3, len(items))
+        self.assertEqual([0, 10, 20], [item.value for item in items])
+        self.assertEqual(['a', 'b', 'c'], [item.kind for item in items])
+        self.assertEqual([5, 5, 5], [item.owner_id for item in items])
+        self.assertEqual(['item-0', 'item-10', 'item-20'], [item.label for item in items])
+        suite = DataSuite()
+        walker = DataWalker(suite)
+        for item in items:
+            walker(item)
+        self.assertEqual([1, 2, 3], [item.id for item in items])
+
+    def testCollectionsAreNotShared(self):
+        class Foo(Builder):
+            __id_fields__ = auto('id')
+        foos = Foo.build_many(2, bars=each(lambda i: one_to_many([Datum('Bar', auto('id'))], 'foo_id')))
+        suite = DataSuite()
+        walker = DataWalker(suite)
+        for foo in foos:
+            walker(foo)
+        self.assertEqual([1, 2], [bar.foo_id for bar in suite['Bar']])
+
+    def testDynamicFieldsAreNotShared(self):
+        class Item(Builder):
+            __id_fields__ = auto('id')
+            label = memoized(lambda datum: 'item-%d' % datum.id)
+        items = Item.build_many(2, slug=Lazy(lambda datum: datum.name), name=each(['a', 'b']))
+        items.extend(Item.build_many(2, tag=memoized(lambda datum: 'tag-%d' % datum.id)))
+        items.append(Item(name='c', slug=Lazy(lambda datum: datum.name)))
+        suite = DataSuite()
+        walker = DataWalker(suite)
+        for item in items:
+            walker(item)
+        self.assertEqual(['a', 'b'], [item.slug for item in items[0:2]])
+        self.assertEqual(['tag-3', 'tag-4'], [item.tag for item in items[2:4]])
+        self.assertEqual('c', items[4].slug)
+        self.assertEqual(['item-1', 'item-2', 'item-3', 'item-4', 'item-5'], [item.label for item in items])
+
+class SlottedDatumTest(TestCase):
+    def testFields(self):
+        User = newDatumClass('User', auto('id'), ('name', 'email'))
+        user = User(name='foo')
+        self.assertEqual('User', user._tableau_schema)
+        self.assertEqual(('id', ), user._tableau_id_fields)
+        self.assertEqual('foo', user.name)
+        self.assertFalse(hasattr(user, '__dict__'))
+        self.assertRaises(AttributeError, getattr, user, 'email')
+        self.assertEqual([('name', 'foo')], user._tableau_fields.items())
+        user.email = lambda datum: '%s@example.com' % datum.name
+        self.assertEqual('foo@example.com', user.email)
+        self.assertRaises(TypeError, User, nickname='foo')
+
+    def testInferFromDatum(self):
+        Item = newDatumClass(Datum('Item', 'id', id=1, value=2))
+        self.assertEqual('Item', Item._tableau_schema)
+        self.assertEqual(('id', 'value'), Item._tableau_field_names)
+
+    def testWalk(self):
+        Foo = newDatumClass('Foo', auto('id'), ('items', ))
+        Bar = newDatumClass('Bar', auto('id'), ('foo_id', 'value'))
+        foo = Foo(items=one_to_many([Bar(value=i) for i in range(0, 3)], 'foo_id'))
+        suite = DataSuite()
+        DataWalker(suite)(foo)
+        self.assertEqual(1, foo.id)
+        self.assertEqual([(1, 1), (2, 1), (3, 1)], [(bar.id, bar.foo_id) for bar in suite['Bar']])
+        self.assertEqual(['Foo', 'Bar'], [dataset.schema for dataset in suite])
+
+class ReferenceGraphTest(TestCase):
+    def testLevels(self):
+        graph = ReferenceGraph()
+        graph.add_reference('C', 'B')
+        graph.add_reference('B', 'A')
+        graph.add_reference('D', 'A')
+        graph.add_reference('E', None)
+        graph.add_reference('C', 'D')
+        self.assertEqual([['A', 'E'], ['B', 'D'], ['C']], graph.get_levels())
+        self.assertEqual(['A', 'E', 'B', 'D', 'C'], graph.getlist())
+
+    def testSelfReference(self):
+        graph = ReferenceGraph()
+        graph.add_reference('Category', 'Category')
+        graph.add_reference('Item', 'Category')
+        self.assertEqual(['Category', 'Item'], graph.getlist())
+
+    def testCycle(self):
+        graph = ReferenceGraph()
+        graph.add_reference('A', None)
+        graph.add_reference('B', 'A')
+        graph.add_reference('C', 'B')
+        graph.add_reference('D', 'C')
+        graph.add_reference('B', 'D')
+        try:
+            graph.getlist()
+            self.fail("No exception raised")
+        except CyclicReferenceError, e:
+            self.assertEqual(['B', 'D', 'C'], e.cycle)
+
+    def testCacheInvalidation(self):
+        graph = ReferenceGraph()
+        graph.add_reference('B', 'A')
+        self.assertEqual(['A', 'B'], graph.getlist())
+        graph.add_reference('A', 'C')
+        self.assertEqual(['C', 'A', 'B'], graph.getlist())
+
+class SQLGeneratorTest(TestCase):
+    def testGenerate(self):
+        foo = Datum(
+            'Foo',
+            'id',
+            id=1,
+            field='a\'b',
+            bars=one_to_many([
+                Datum('Bar', auto('id'), value=1),
+                Datum('Bar', auto('id'), value=2)
+                ],
+                'foo_id'
+                )
+            )
+        suite = DataSuite()
+        DataWalker(suite)(foo)
+        sql = _generate(suite)
+        self.assertEqual(
+            "INSERT INTO `Foo` (`id`, `field`) VALUES\n"
+            "(1, 'a''b');\n"
+            "INSERT INTO `Bar` (`id`, `foo_id`, `value`) VALUES\n"
+            "(1, 1, 1),\n"
+            "(2, 1, 2);\n",
+            sql)
+
+    def testGenerateMixedShapes(self):
+        class Name(unicode):
+            pass
+        suite = DataSuite()
+        walker = DataWalker(suite)
+        walker(Datum('Foo', ('id2', 'id1'), id1=1, id2=1, name=Name(u'a'), flag=True))
+        walker(Datum('Foo', ('id2', 'id1'), id1=2, id2=1, name=u'b', flag=False))
+        walker(Datum('Foo', ('id2', 'id1'), id1=3, id2=1, name=u'c'))
+        walker(Datum('Foo', ('id2', 'id1'), id1=4, id2=1, name=u'd', flag=lambda datum: False))
+        sql = _generate(suite)
+        self.assertEqual(
+            "INSERT INTO `Foo` (`id2`, `id1`, `flag`, `name`) VALUES\n"
+            "(1, 1, 1, 'a'),\n"
+            "(1, 2, 0, 'b');\n"
+            "INSERT INTO `Foo` (`id2`, `id1`, `name`) VALUES\n"
+            "(1, 3, 'c');\n"
+            "INSERT INTO `Foo` (`id2`, `id1`, `flag`, `name`) VALUES\n"
+            "(1, 4, 0, 'd');\n",
+            sql)
+
+    def testNormalizeColumns(self):
+        suite = DataSuite()
+        walker = DataWalker(suite)
+        walker(Datum('Foo', auto('id'), a=1))
+        walker(Datum('Foo', auto('id'), b=2))
+        walker(Datum('Foo', auto('id'), a=3, b=4))
+        sql = _generate(suite, normalize_columns=True)
+        self.assertEqual(
+            "INSERT INTO `Foo` (`id`, `a`, `b`) VALUES\n"
+            "(1, 1, NULL),\n"
+            "(2, NULL, 2),\n"
+            "(3, 3, 4);\n",
+            sql)
+        sql = _generate(suite, normalize_columns=True, use_default=True)
+        self.assertEqual(
+            "INSERT INTO `Foo` (`id`, `a`, `b`) VALUES\n"
+            "(1, 1, DEFAULT),\n"
+            "(2, DEFAULT, 2),\n"
+            "(3, 3, 4);\n",
+            sql)
+
+    def testMaxStatementSize(self):
+        suite = DataSuite()
+        walker = DataWalker(suite)
+        for i in range(0, 5):
+            walker(Datum('Foo', auto('id'), value='x' * 10))
+        sql = _generate(suite, max_statement_size=80)
+        self.assertEqual(
+            "INSERT INTO `Foo` (`id`, `value`) VALUES\n"
+            "(1, 'xxxxxxxxxx'),\n"
+            "(2, 'xxxxxxxxxx');\n"
+            "INSERT INTO `Foo` (`id`, `value`) VALUES\n"
+            "(3, 'xxxxxxxxxx'),\n"
+            "(4, 'xxxxxxxxxx');\n"
+            "INSERT INTO `Foo` (`id`, `value`) VALUES\n"
+            "(5, 'xxxxxxxxxx');\n",
+            sql)
+
+    def _buildEscapingSuite(self):
+        foo = Datum(
+            'Foo',
+            'id',
+            id=1,
+            name=u'a\tb\\c\nd\u3042',
+            bars=one_to_many([
+                Datum('Bar', auto('id'), note='x\ry'),
+                Datum('Bar', auto('id'), note=None)
+                ],
+                'foo_id'
+                )
+            )
+        suite = DataSuite()
+        DataWalker(suite)(foo)
+        return suite
+
+    def testPostgreSQLCopy(self):
+        sql = _generate(self._buildEscapingSuite(), builder_impl=PostgreSQLCopyBuilder)
+        self.assertEqual(
+            'COPY "Foo" ("id", "name") FROM STDIN;\n'
+            '1\ta\\tb\\\\c\\nd\xe3\x81\x82\n'
+            '\\.\n'
+            'COPY "Bar" ("id", "foo_id", "note") FROM STDIN;\n'
+            '1\t1\tx\\ry\n'
+            '2\t1\t\\N\n'
+            '\\.\n',
+            sql)
+
+    def testMySQLLoadData(self):
+        import os
+        import shutil
+        import tempfile
+        directory = tempfile.mkdtemp()
+        try:
+            sql = _generate(self._buildEscapingSuite(), builder_impl=MySQLLoadDataBuilder, directory=directory, charset='utf8')
+            self.assertEqual(
+                "LOAD DATA INFILE '%s' INTO TABLE `Foo` CHARACTER SET utf8 (`id`, `name`);\n"
+                "LOAD DATA INFILE '%s' INTO TABLE `Bar` CHARACTER SET utf8 (`id`, `foo_id`, `note`);\n" % (
+                    os.path.join(directory, 'Foo.tsv'),
+                    os.path.join(directory, 'Bar.tsv')),
+                sql)
+            self.assertEqual(
+                '1\ta\\tb\\\\c\\nd\xe3\x81\x82\n',
+                open(os.path.join(directory, 'Foo.tsv'), 'rb').read())
+            self.assertEqual(
+                '1\t1\tx\\ry\n'
+                '2\t1\t\\N\n',
+                open(os.path.join(directory, 'Bar.tsv'), 'rb').read())
+        finally:
+            shutil.rmtree(directory)
+
+    def _buildSuite(self):
+        return _build_foos(20, lambda: [Datum('Bar', auto('id'), value=j) for j in range(0, 50)])
+
+    def testGenerateWithThreadPool(self):
+        from multiprocessing.dummy import Pool
+        suite = self._buildSuite()
+        pool = Pool(4)
+        try:
+            self.assertEqual(_generate(suite), _generate(suite, pool=pool, chunk_size=7))
+            self.assertEqual(_generate(suite, max_statement_size=100), _generate(suite, pool=pool, chunk_size=7, max_statement_size=100))
+            self.assertEqual(
+                _generate(suite, builder_impl=PostgreSQLCopyBuilder),
+                _generate(suite, pool=pool, chunk_size=7, builder_impl=PostgreSQLCopyBuilder))
+        finally:
+            pool.close()
+
+    def testGenerateWithProcessPool(self):
+        from multiprocessing import Pool
+        suite = self._buildSuite()
+        pool = Pool(2)
+        try:
+            self.assertEqual(_generate(suite), _generate(suite, pool=pool, chunk_size=64))
+        finally:
+            pool.close()
+
+    def testGenerateSinceCheckpoint(self):
+        country = Datum('Country', 'code', code='JP')
+        suite = DataSuite()
+        walker = DataWalker(suite)
+        walker(Datum('User', auto('id'), country=many_to_one(country, 'country_code')))
+        checkpoint = suite.checkpoint()
+        walker(Datum('User', auto('id'), country=many_to_one(country, 'country_code'),
+                     posts=one_to_many([Datum('Post', auto('id'))], 'user_id')))
+        sql = _generate(suite, checkpoint)
+        self.assertEqual(
+            "INSERT INTO `User` (`id`, `country_code`) VALUES\n"
+            "(2, 'JP');\n"
+            "INSERT INTO `Post` (`id`, `user_id`) VALUES\n"
+            "(1, 2);\n",
+            sql)
+        self.assertEqual([], list(suite.since(suite.checkpoint())))
+
+    def testStream(self):
+        country = Datum('Country', 'code', code='JP')
+        def roots():
+            for i in range(0, 3):
+                yield Datum(
+                    'User',
+                    auto('id'),
+                    country=many_to_one(country, 'country_code'),
+                    posts=one_to_many([Datum('Post', auto('id'))], 'user_id')
+                    )
+        out = StringIO()
+        suite = SQLGenerator(out, encoding='utf-8').stream(roots())
+        self.assertEqual(
+            "INSERT INTO `Country` (`code`) VALUES\n"
+            "('JP');\n"
+            "INSERT INTO `User` (`id`, `country_code`) VALUES\n"
+            "(1, 'JP');\n"
+            "INSERT INTO `Post` (`id`, `user_id`) VALUES\n"
+            "(1, 1);\n"
+            "INSERT INTO `User` (`id`, `country_code`) VALUES\n"
+            "(2, 'JP');\n"
+            "INSERT INTO `Post` (`id`, `user_id`) VALUES\n"
+            "(2, 2);\n"
+            "INSERT INTO `User` (`id`, `country_code`) VALUES\n"
+            "(3, 'JP');\n"
+            "INSERT INTO `Post` (`id`, `user_id`) VALUES\n"
+            "(3, 3);\n",
+            out.getvalue())
+        for dataset in suite:
+            self.assertEqual(0, len(dataset.data))
+
+class ParallelWalkerTest(TestCase):
+    def testEquivalentToSerialWalk(self):
+        from tableau.parallel import ParallelWalker
+        serial = DataSuite()
+        walker = DataWalker(serial)
+        for i in range(0, 10):
+            walker(_build_tenant(i))
+        for processes in (1, 3, 4):
+            merged = ParallelWalker(DataSuite(), processes)(_build_tenant, range(0, 10))
+            self.assertEqual(serial.digraph.getlist(), merged.digraph.getlist())
+            self.assertEqual(_generate(serial), _generate(merged))
+            self.assertEqual(serial['User'].seq, merged['User'].seq)
+
+    def testMergeIntoExistingSuite(self):
+        from tableau.parallel import ParallelWalker
+        serial = DataSuite()
+        walker = DataWalker(serial)
+        for i in range(0, 6):
+            walker(_build_tenant(i))
+        suite = DataSuite()
+        walker = DataWalker(suite)
+        for i in range(0, 2):
+            walker(_build_tenant(i))
+        ParallelWalker(suite, 2)(_build_tenant, range(2, 6))
+        self.assertEqual(_generate(serial), _generate(suite))
+
+    def testFailure(self):
+        from tableau.parallel import ParallelWalker
+        self.assertRaises(RuntimeError, ParallelWalker(DataSuite(), 2), _build_tenant, [0, None])
+
+class InstrumentationTest(TestCase):
+    def _build(self, i):
+        country = Datum('Country', auto('id'), code='C%d' % i)
+        return Datum(
+            'Foo',
+            auto('id'),
+            country=many_to_one(country, 'country_id'),
+            slug=lambda datum: 'foo-%d' % datum.id,
+            bars=one_to_many([Datum('Bar', auto('id')) for j in range(0, 3)], 'foo_id')
+            )
+
+    def testMetricsCollector(self):
+        from tableau.instrumentation import MetricsCollector, observe_lazy
+        collector = MetricsCollector()
+        observe_lazy(collector)
+        try:
+            suite = DataSuite(observer=collector)
+            walker = DataWalker(suite)
+            for i in range(0, 2):
+                walker(self._build(i))
+            sql = _generate(suite, observer=collector)
+        finally:
+            observe_lazy(None)
+        self.assertEqual({'Foo': 2, 'Country': 2, 'Bar': 6}, collector.rows)
+        self.assertEqual(10, collector.peak_size)
+        self.assertEqual(
+            [('many_to_one', 'Foo', 'country'), ('one_to_many', 'Foo', 'bars')],
+            sorted(collector.relations))
+        self.assertEqual(2, collector.relations[('one_to_many', 'Foo', 'bars')][0])
+        self.assertEqual([('Foo', 'slug')], collector.lazy_fields.keys())
+        self.assertEqual(len(sql), collector.bytes_written)
+        self.assertEqual(3, collector.statements_flushed)
+        self.assertEqual(2, collector.phases['walk'][0])
+        self.assertEqual(1, collector.phases['emit'][0])
+        self.assertTrue('Foo.bars (one_to_many)' in collector.summary())
+
+    def testPeakSizeWhileStreaming(self):
+        from tableau.instrumentation import MetricsCollector
+        collector = MetricsCollector()
+        out = StringIO()
+        SQLGenerator(out, encoding='utf-8', observer=collector).stream(self._build(i) for i in range(0, 3))
+        self.assertEqual({'Foo': 3, 'Country': 3, 'Bar': 9}, collector.rows)
+        self.assertEqual(5, collector.peak_size)
+        self.assertEqual(0, collector.size)
+        self.assertEqual(3, collector.phases['walk'][0])
+        self.assertEqual(3, collector.phases['emit'][0])
+
+class BenchmarksTest(TestCase):
+    def testRunAndCompare(self):
+        from tableau.benchmarks import run, compare
+        results = run(['walk.fanout', 'sql.*'], sizes=[202], repeat=1)
+        self.assertEqual(['sql.chain/202', 'sql.fanout/202', 'sql.sqla/202', 'sql.via/202', 'sql.wide/202', 'walk.fanout/202'], sorted(results['results']))
+        self.assertEqual(202, results['results']['walk.fanout/202']['items'])
+        baseline = {'results': dict((key, dict(result)) for key, result in results['results'].iteritems())}
+        baseline['results']['walk.fanout/202']['best'] /= 2.
+        del baseline['results']['sql.wide/202']
+        rows, regressions = compare(baseline, results, 0.5)
+        self.assertEqual(5, len(rows))
+        self.assertEqual(['walk.fanout/202'], regressions)
+
+class DBAPILoaderTest(TestCase):
+    def setUp(self):
+        import sqlite3
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.execute('CREATE TABLE Foo (id INTEGER PRIMARY KEY, name TEXT)')
+        self.connection.execute('CREATE TABLE Bar (id INTEGER PRIMARY KEY, foo_id INTEGER NOT NULL REFERENCES Foo (id), value INTEGER, note TEXT)')
+
+    def tearDown(self):
+        self.connection.close()
+
+    def _buildSuite(self):
+        return _build_foos(3, lambda: [Datum('Bar', auto('id'), value=j) for j in range(0, 4)] + [Datum('Bar', auto('id'), value=4, note=u'note')])
+
+    def testLoad(self):
+        DBAPILoader(self.connection, batch_size=2)(self._buildSuite())
+        self.assertEqual(
+            [(1, u'foo0'), (2, u'foo1'), (3, u'foo2')],
+            self.connection.execute('SELECT id, name FROM Foo ORDER BY id').fetchall())
+        self.assertEqual(15, self.connection.execute('SELECT COUNT(*) FROM Bar').fetchone()[0])
+        self.assertEqual(
+            [(5, 1, 4, u'note'), (6, 2, 0, None)],
+            self.connection.execute('SELECT id, foo_id, value, note FROM Bar WHERE id IN (5, 6) ORDER BY id').fetchall())
+
+    def testLoadNamedWithNormalizedColumns(self):
+        DBAPILoader(self.connection, paramstyle='named', normalize_columns=True)(self._buildSuite())
+        self.assertEqual(
+            [(14, 3, 3, None), (15, 3, 4, u'note')],
+            self.connection.execute('SELECT id, foo_id, value, note FROM Bar WHERE id > 13 ORDER BY id').fetchall())
+
+class SinkTest(TestCase):
+    def setUp(self):
+        import os
+        import sqlite3
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.sqlite')
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE Foo (id INTEGER PRIMARY KEY, name TEXT)')
+        connection.execute('CREATE TABLE Bar (id INTEGER PRIMARY KEY, foo_id INTEGER NOT NULL REFERENCES Foo (id), value INTEGER)')
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def _loader(self, script):
+        import sys
+        return [sys.executable, '-c', 'import sys, sqlite3\n' + script, self.path]
+
+    def testLoad(self):
+        import sqlite3
+        from tableau.sink import spawn_loader
+        sink = spawn_loader(
+            self._loader('connection = sqlite3.connect(sys.argv[1])\nconnection.executescript(sys.stdin.read())\nconnection.commit()'),
+            encoding='utf-8', chunk_size=256, max_chunks=2)
+        try:
+            SQLGenerator(sink, max_statement_size=512).stream(
+                Datum('Foo', auto('id'), name=u'foo%d' % i, bars=one_to_many([Datum('Bar', auto('id'), value=j) for j in range(0, 10)], 'foo_id'))
+                for i in range(0, 100))
+        finally:
+            sink.close()
+        connection = sqlite3.connect(self.path)
+        try:
+            self.assertEqual((100, ), connection.execute('SELECT COUNT(*) FROM Foo').fetchone())
+            self.assertEqual((1000, 4500), connection.execute('SELECT COUNT(*), SUM(value) FROM Bar').fetchone())
+            self.assertEqual((u'foo99', ), connection.execute('SELECT name FROM Foo WHERE id = 100').fetchone())
+        finally:
+            connection.close()
+
+    def testFailure(self):
+        from subprocess import CalledProcessError
+        from tableau.sink import spawn_loader
+        sink = spawn_loader(self._loader('sys.exit(3)'), encoding='utf-8', chunk_size=16, max_chunks=1)
+        try:
+            for i in range(0, 1000):
+                sink.write('INSERT INTO `Foo` (`name`) VALUES (\'foo\');\n')
+        except IOError:
+            pass
+        try:
+            sink.close()
+            self.fail("No exception raised")
+        except CalledProcessError, e:
+            self.assertEqual(3, e.returncode)
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def _buildSuite(self):
+        return _build_foos(
+            3,
+            lambda: [Datum('Bar', ('foo_id', 'seq'), seq=j) for j in range(0, 2)],
+            slug=lambda datum: 'slug-%d' % datum.id
+            )
+
+    def testSaveAndLoad(self):
+        import os
+        from tableau.snapshot import source_key
+        from tableau import tests
+        path = os.path.join(self.directory, 'suite.snapshot')
+        key = source_key(tests)
+        suite = self._buildSuite()
+        for compress in (False, True):
+            suite.save_snapshot(path, key, compress=compress)
+            self.assertEqual(None, DataSuite.load_snapshot(path, 'another'))
+            loaded = DataSuite.load_snapshot(path, key)
+            self.assertEqual(_generate(suite), _generate(loaded))
+            self.assertEqual(['Foo', 'Bar'], [dataset.schema for dataset in loaded])
+            self.assertEqual('slug-2', [datum for datum in loaded['Foo']][1].slug)
+            foo = Datum('Foo', auto('id'), name=u'foo3')
+            DataWalker(loaded)(foo)
+            self.assertEqual(4, foo.id)
+
+    def testLoadMissing(self):
+        import os
+        self.assertEqual(None, DataSuite.load_snapshot(os.path.join(self.directory, 'nonexistent')))
+
+class StagingTest(TestCase):
+    def setUp(self):
+        from tableau.staging import SQLiteStore
+        self.store = SQLiteStore(spill_threshold=5)
+
+    def tearDown(self):
+        import os
+        self.store.close()
+        self.assertFalse(os.path.exists(self.store.path))
+
+    def _roots(self):
+        return [_build_tenant(i) for i in range(0, 4)]
+
+    def testSpill(self):
+        expected = DataSuite()
+        for root in self._roots():
+            DataWalker(expected)(root)
+        suite = DataSuite(store=self.store)
+        walker = DataWalker(suite)
+        roots = self._roots()
+        for root in roots[0:2]:
+            walker(root)
+        checkpoint = suite.checkpoint()
+        for root in roots[2:]:
+            walker(root)
+        self.assertEqual(7, len(suite['User']))
+        self.assertTrue(len(suite['User'].data) < 5)
+        walker(roots[0])
+        self.assertEqual(7, len(suite['User']))
+        self.assertEqual(_generate(expected, checkpoint), _generate(suite, checkpoint))
+        self.assertEqual(_generate(expected), _generate(suite))
+        self.assertEqual(['tenant-1', 'tenant-2', 'tenant-3', 'tenant-4'], [datum.slug for datum in suite['Tenant']])
+        self.assertEqual(['user2-0', 'user2-1', 'user2-2'], [datum.name for datum in suite.find('User', tenant_id=3)])
+        self.assertEqual('user2-1', suite.lookup('User', 5).name)
+        self.assertEqual([suite.lookup('User', 5).id], [datum.id for datum in suite.find('User', id=5)])
+        self.assertEqual(None, suite.lookup('User', 8))
+
+    def testFindDuringWalk(self):
+        def build(suite, found):
+            country = Datum('Country', auto('id'), code='JP')
+            return Datum(
+                'Foo',
+                auto('id'),
+                name='a',
+                p=lambda datum: found.extend(suite.find('Foo', name='a')) or len(suite.find('Foo', name='a')),
+                country=many_to_one(country, 'country_id')
+                )
+        expected = DataSuite()
+        DataWalker(expected)(build(expected, []))
+        for spill_threshold in (1, 10000):
+            from tableau.staging import SQLiteStore
+            store = SQLiteStore(spill_threshold=spill_threshold)
+            try:
+                suite = DataSuite(store=store)
+                found = []
+                root = build(suite, found)
+                DataWalker(suite)(root)
+                self.assertEqual(root, found[0])
+                self.assertEqual(_generate(expected), _generate(suite))
+                self.assertEqual('a', suite.lookup('Foo', 1).name)
+            finally:
+                store.close()
+
+    def testObserver(self):
+        from tableau.instrumentation import MetricsCollector
+        collector = MetricsCollector()
+        suite = DataSuite(store=self.store, observer=collector)
+        walker = DataWalker(suite)
+        for root in self._roots():
+            walker(root)
+        self.assertEqual(7, collector.rows['User'])
+        self.assertTrue(collector.peak_size < 10, collector.peak_size)
+        _generate(suite)
+        self.assertEqual(0, collector.size)
+
+    def testStream(self):
+        expected = StringIO()
+        SQLGenerator(expected, encoding='utf-8').stream(self._roots())
+        out = StringIO()
+        suite = SQLGenerator(out, encoding='utf-8').stream(self._roots(), DataSuite(store=self.store))
+        self.assertEqual(expected.getvalue(), out.getvalue())
+        self.assertEqual(0, len(suite['User']))
+        self.assertEqual([], suite['User'].get())
+
 class SADatumTest(TestCase):
     def assertIsInstance(self, a, klasses, msg=None):
         self.assertTrue(isinstance(a, klasses), msg)
@@ -408,6 +1307,74 @@ class SADatumTest(TestCase):
         self.assertEqual(1, datum.bars[0].id)
         self.assertEqual(2, datum.bars[1].id)
 
+    def testBulkLoader(self):
+        from tableau.sqla import SABulkLoader
+        class Foo(self.declarative_base):
+            __tablename__ = 'Foo'
+            id = Column(Integer, primary_key=True)
+            field = Column(String)
+            bars = relationship('Bar')
+
+        class Bar(self.declarative_base):
+            __tablename__ = 'Bar'
+            id = Column(Integer, primary_key=True)
+            type = Column(String)
+            foo_id = Column(Integer, ForeignKey('Foo.id'))
+            __mapper_args__ = { 'polymorphic_on': type }
+
+        class Foobar(Bar):
+            __tablename__ = 'Foobar'
+            __mapper_args__ = {'polymorphic_identity': 'foobar'}
+            id = Column(Integer, ForeignKey('Bar.id'), primary_key=True)
+            extra = Column(String)
+
+        tag = Table('Tag', self.metadata,
+            Column('id', Integer, primary_key=True),
+            Column('foo_id', Integer, ForeignKey('Foo.id')),
+            Column('name', String)
+            )
+        Table('Label', self.metadata,
+            Column('id', Integer, primary_key=True),
+            Column('name', String)
+            )
+        Table('TagLabel', self.metadata,
+            Column('tag_id', Integer, ForeignKey('Tag.id'), primary_key=True),
+            Column('label_id', Integer, ForeignKey('Label.id'), primary_key=True)
+            )
+
+        SADatum = self.SADatum = newSADatum(self.metadata)
+        labels = [SADatum('Label', name='label%d' % i) for i in range(0, 2)]
+        suite = DataSuite(allocators=SADatum.allocators())
+        walker = DataWalker(suite)
+        for i in range(0, 2):
+            walker(SADatum(
+                'Foo',
+                field='foo%d' % i,
+                bars=one_to_many([
+                    SADatum('Bar'),
+                    SADatum('Foobar', extra='extra%d' % i),
+                    ], 'foo_id')
+                ))
+            walker(SADatum('Tag', foo_id=i + 1, name='tag%d' % i, labels=many_to_many(labels[i:], 'tag_id', 'label_id', via='TagLabel')))
+        engine = create_engine('sqlite+pysqlite:///')
+        self.metadata.create_all(engine)
+        SABulkLoader(engine, batch_size=1, metadata=self.metadata)(suite)
+        self.assertEqual(
+            [(1, 'foo0'), (2, 'foo1')],
+            list(engine.execute('SELECT id, field FROM Foo ORDER BY id')))
+        self.assertEqual(
+            [(1, None, 1), (2, 'foobar', 1), (3, None, 2), (4, 'foobar', 2)],
+            list(engine.execute('SELECT id, type, foo_id FROM Bar ORDER BY id')))
+        self.assertEqual(
+            [(2, 'extra0'), (4, 'extra1')],
+            list(engine.execute('SELECT id, extra FROM Foobar ORDER BY id')))
+        self.assertEqual(
+            [(1, 1, 'tag0'), (2, 2, 'tag1')],
+            list(engine.execute('SELECT id, foo_id, name FROM Tag ORDER BY id')))
+        self.assertEqual(
+            [(1, 1), (1, 2), (2, 2)],
+            list(engine.execute('SELECT tag_id, label_id FROM TagLabel ORDER BY tag_id, label_id')))
+
     def testDefaultValue(self):
         table = Table('Test', self.metadata,
             Column('id', Integer, primary_key=True),
@@ -430,6 +1397,96 @@ class SADatumTest(TestCase):
         self.assertEqual(table, datum2._tableau_table)
         self.assertEqual('test', datum2.field)
 
+    def testOneToManyWithoutMapper(self):
+        Table('Foo', self.metadata,
+            Column('id', Integer, primary_key=True),
+            Column('name', String)
+            )
+        Table('Bar', self.metadata,
+            Column('id', Integer, primary_key=True),
+            Column('foo_id', Integer, ForeignKey('Foo.id'))
+            )
+        SADatum = self.SADatum = newSADatum(self.metadata)
+        foo = SADatum('Foo', name='x', bars=one_to_many([SADatum('Bar')], 'foo_id'))
+        suite = DataSuite()
+        DataWalker(suite)(foo)
+        self.assertEqual([1], [datum.foo_id for datum in suite['Bar']])
+
+    def testTemplate(self):
+        table = Table('Test', self.metadata,
+            Column('id', Integer, primary_key=True),
+            Column('field', String, default='foo')
+            )
+        SADatum = self.SADatum = newSADatum(self.metadata)
+        datum1 = SADatum('Test', field='bar', extra=1)
+        datum2 = SADatum('Test')
+        self.assertTrue(datum1.__class__ is datum2.__class__)
+        self.assertTrue(datum1._tableau_template is datum2._tableau_template)
+        self.assertEqual(auto('id'), datum1._tableau_id_fields)
+        self.assertEqual({'id': None, 'field': 'foo'}, datum2._tableau_template.defaults)
+        self.assertEqual('bar', datum1.field)
+        self.assertEqual('foo', datum2.field)
+        self.assertEqual(1, datum1.extra)
+        datum2.field = 'baz'
+        self.assertEqual('baz', datum2.field)
+        self.assertEqual('baz', datum2._tableau_fields['field'])
+        try:
+            datum2.extra
+            self.fail("No exception raised")
+        except AttributeError, e:
+            self.assertEqual('Test.extra', e.args[0])
+        self.assertEqual(('id', ), SADatum('Test', ('id', ))._tableau_id_fields)
+        for i in range(0, 2):
+            try:
+                SADatum('Test', 'oops')
+                self.fail("No exception raised")
+            except ValueError, e:
+                self.assertEqual("id_fields does not match to the table definition ([oops] != [id])", e.args[0])
+
+    def testSharedFactory(self):
+        from tableau.sqla import sharedSADatum, _shared_factories
+        class Foo(self.declarative_base):
+            __tablename__ = 'Foo'
+            id = Column(Integer, primary_key=True)
+            bars = relationship('Bar')
+        class Bar(self.declarative_base):
+            __tablename__ = 'Bar'
+            id = Column(Integer, primary_key=True)
+            foo_id = Column(Integer, ForeignKey('Foo.id'))
+        SADatum = self.SADatum = sharedSADatum(self.metadata)
+        self.assertTrue(SADatum is sharedSADatum(self.metadata))
+        self.assertTrue(SADatum.mixin_class_of(Foo).__mapper__.configured)
+        self.assertTrue(SADatum.mixin_class_of(Bar).__mapper__.configured)
+        datum = SADatum('Foo', bars=[SADatum('Bar')])
+        self.assertTrue(isinstance(datum, SADatum.mixin_class_of(Foo)))
+        self.assertTrue(isinstance(datum.bars[0], SADatum.mixin_class_of(Bar)))
+
+        class Baz(self.declarative_base):
+            __tablename__ = 'Baz'
+            id = Column(Integer, primary_key=True)
+        self.assertEqual(None, SADatum('Baz')._tableau_managed_class)
+        SADatum.reset()
+        self.assertTrue(SADatum('Baz')._tableau_managed_class is Baz)
+        self.assertTrue(isinstance(SADatum('Foo'), SADatum.mixin_class_of(Foo)))
+
+        SADatum.cleanup()
+        self.assertFalse(self.metadata in _shared_factories)
+        self.SADatum = sharedSADatum(self.metadata)
+        self.assertFalse(self.SADatum is SADatum)
+
+    def testCoexistingFactories(self):
+        class Test(self.declarative_base):
+            __tablename__ = 'Test'
+            id = Column(Integer, primary_key=True)
+        SADatum1 = self.SADatum = newSADatum(self.metadata).prepare()
+        try:
+            SADatum2 = newSADatum(self.metadata)
+            self.assertTrue(SADatum2('Test')._tableau_managed_class is Test)
+            SADatum2.cleanup()
+        finally:
+            SADatum1.cleanup()
+        self.SADatum = None
+
     def testReentrance(self):
         class Test(self.declarative_base):
             __tablename__ = 'Test'